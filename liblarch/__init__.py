@@ -17,12 +17,18 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 # -----------------------------------------------------------------------------
 
-from .filters_bank import FiltersBank
+from . import snapshot
+from .filters_bank import FiltersBank, And, Or, Not
 from .tree import MainTree
 from .treenode import _Node
 from .viewcount import ViewCount
 from .viewtree import ViewTree
 
+__all__ = [
+    'API', 'is_compatible', 'TreeNode', 'Tree', 'ViewTree', 'ViewCount',
+    'And', 'Or', 'Not',
+]
+
 # API version of liblarch.
 # Your application is compatible if the major version number match liblarch's
 # one and if your minor version number is inferior to liblarch's one.
@@ -90,6 +96,51 @@ class Tree(object):
         """ Refresh all nodes """
         self.__tree.refresh_all()
 
+    def save_snapshot(self, path, payload=None):
+        """ Save nodes with their relationships into a binary file
+
+        @param payload - function returning bytes which are stored with
+            a node, e.g. serialized data of the application, or None
+        """
+        snapshot.save(self.__tree, path, payload)
+
+    def load_snapshot(self, path, factory=None):
+        """ Load nodes saved by save_snapshot() into this tree
+
+        The tree must be empty. Views get one update for all nodes.
+
+        @param factory - function creating a node from node_id and its
+            stored payload (None if there is none). TreeNode by default.
+        """
+        if factory is None:
+            def factory(node_id, payload):
+                return TreeNode(node_id)
+        snapshot.load(self.__tree, path, factory)
+
+    def get_stats(self):
+        """ Return statistics about the tree, e.g. number of nodes and
+        number of pending relationships """
+        return self.__tree.get_stats()
+
+    def begin_update(self):
+        """ Start a batch of changes. Views are not informed about changes
+        until the matching end_update() is called. """
+        self.__tree.begin_update()
+
+    def end_update(self):
+        """ Finish a batch of changes and send one combined set of changes
+        to views """
+        self.__tree.end_update()
+
+    def batch(self):
+        """ Group changes together:
+
+            with tree.batch():
+                for node in nodes:
+                    tree.add_node(node)
+        """
+        return self.__tree.batch()
+
     def move_node(self, node_id, new_parent_id=None):
         """ Move the node to a new parent (dismissing all other parents)
         use pid None to move it to the root """
@@ -102,6 +153,14 @@ class Tree(object):
 
         return toreturn
 
+    def is_ancestor(self, ancestor_id, node_id):
+        """ Is ancestor_id a parent, grandparent, ... of node_id? """
+        return self.__tree.is_ancestor(ancestor_id, node_id)
+
+    def count_paths(self, node_id):
+        """ Return the number of instances of node_id in the tree """
+        return self.__tree.count_paths(node_id)
+
     def add_parent(self, node_id, new_parent_id=None):
         """ Add the node to a new parent. Return whether operation was
         successful or not. If the node does not exists, return False """
@@ -118,7 +177,7 @@ class Tree(object):
         """
         return self.__views['main']
 
-    def get_viewtree(self, name=None, refresh=True):
+    def get_viewtree(self, name=None, refresh=True, lazy=False):
         """ Returns a viewtree by the name:
           * a viewtree with that name exists => return it
           * a viewtree with that name does not exist => create a new one and
@@ -127,13 +186,17 @@ class Tree(object):
 
         If refresh is False, the view is not initialized. This is useful as
         an optimization if you plan to apply a filter.
+
+        A lazy view computes children of a node only when it is expanded,
+        see ViewTree.expand_node().
         """
 
         if name is not None and name in self.__views:
             view_tree = self.__views[name]
         else:
             view_tree = ViewTree(
-                self, self.__tree, self.__fbank, name=name, refresh=refresh)
+                self, self.__tree, self.__fbank, name=name, refresh=refresh,
+                lazy=lazy)
             if name is not None:
                 self.__views[name] = view_tree
         return view_tree
@@ -169,3 +232,13 @@ class Tree(object):
         added here can be removed. Return False if the filter was not removed.
         """
         return self.__fbank.remove_filter(filter_name)
+
+    def set_filter_profiling(self, enabled=True):
+        """ Start or stop collecting statistics of filters, like numbers of
+        calls, latencies and pass ratios """
+        self.__fbank.set_profiling(enabled)
+
+    def get_filter_profile(self):
+        """ Return statistics of filters, the most expensive first.
+        See FiltersBank.get_profile() """
+        return self.__fbank.get_profile()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Liblarch - a library to handle directed acyclic graphs
+# Copyright (c) 2011-2012 - Lionel Dricot & Izidor Matušov
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+
+class CallbackRegistry(object):
+    """ Callbacks registered for events
+
+    Callbacks of an event are kept in a tuple which is replaced on every
+    (de)registration. Sending an event iterates the current tuple, it is
+    never modified and there is no need to copy it.
+
+    Keys are never reused, every registration gets a new one.
+    """
+
+    def __init__(self):
+        self._callbacks = {}
+        self._next_key = 0
+
+    def register(self, event, func):
+        """ Store function and return unique key which can be used to
+        unregister the callback later """
+        key = self._next_key
+        self._next_key += 1
+        self._callbacks[event] = self._callbacks.get(event, ()) + (
+            (key, func), )
+        return key
+
+    def deregister(self, event, key):
+        """ Remove the callback identified by key, unknown keys are ignored
+        """
+        callbacks = self._callbacks.get(event, ())
+        remaining = tuple(
+            (cb_key, func) for cb_key, func in callbacks if cb_key != key)
+        if remaining:
+            self._callbacks[event] = remaining
+        elif event in self._callbacks:
+            del self._callbacks[event]
+
+    def get(self, event):
+        """ Return tuple of (key, func) registered for the event """
+        return self._callbacks.get(event, ())
+
+    def get_counts(self):
+        """ Return number of callbacks registered for every event """
+        return dict(
+            (event, len(callbacks))
+            for event, callbacks in self._callbacks.items())
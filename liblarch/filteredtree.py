@@ -17,8 +17,34 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 # -----------------------------------------------------------------------------
 
+import functools
+import heapq
+import itertools
+import sys
+
 from gi.repository import GObject
 
+from .filters_bank import And
+from .indexedlist import IndexedList
+
+
+class _ViewNode(object):
+    """ Displayed node of FilteredTree: ids of its displayed parents and
+    children, the number of displayed instances below it and its cached
+    sort key """
+
+    __slots__ = ('parents', 'children', 'n_descendants', 'sort_key')
+
+    def __init__(self, parents=None):
+        self.parents = parents if parents is not None else []
+        self.children = IndexedList()
+        self.n_descendants = 0
+        self.sort_key = None
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + sys.getsizeof(self.parents) +
+                sys.getsizeof(self.children))
+
 
 class FilteredTree(object):
     """ FilteredTree is the most important and also the most buggy part of
@@ -36,13 +62,16 @@ class FilteredTree(object):
     that by a simple recursion.
     """
 
-    def __init__(self, tree, filtersbank, name=None, refresh=True):
+    def __init__(self, tree, filtersbank, name=None, refresh=True,
+                 lazy=False):
         """ Construct a layer where filters could by applied
 
         @param tree: Original tree to filter.
         @param filtersbank: Filter bank which stores filters
         @param refresh: Requests all nodes in the beginning? Additional
             filters can be added and refresh can be done later
+        @param lazy: Only children of expanded nodes are computed and sent,
+            see expand_node()
 
         _flat defines whether only nodes without children can be shown.
         For example WorkView filter.
@@ -50,6 +79,18 @@ class FilteredTree(object):
 
         self.cllbcks = {}
 
+        # Worklist of __propagate(): heap of (priority, order, node_id) and
+        # directions and priorities of scheduled nodes
+        self.__worklist = []
+        self.__worklist_order = itertools.count()
+        self.__pending = {}
+        self.__propagating = False
+        self.__propagation_stats = {
+            'events': 0, 'updates': 0, 'last': 0, 'max': 0}
+        # Changes collected for the 'changes' callback, see __in_round()
+        self.__rounds = 0
+        self.__changes = []
+
         # Cache
         self.nodes = {}
         # Set root_id by the name of FilteredTree
@@ -58,19 +99,44 @@ class FilteredTree(object):
         else:
             self.root_id = "root_%s" % name
 
-        self.nodes[self.root_id] = {'parents': [], 'children': []}
+        self.nodes[self.root_id] = _ViewNode()
+        # Paths of displayed nodes and their sets for lookups. If a node is
+        # cached, all its displayed ancestors are cached as well.
         self.cache_paths = {}
+        self.cache_path_sets = {}
+        # Counters for get_nodes(withfilters), see __get_counter()
         self.filter_cache = {}
+        # Positions of nodes while their deletion is sent, see
+        # __unlink_deleted()
+        self.__deleted_positions = {}
 
         # Connect to signals from MainTree
         self.tree = tree
-        self.tree.register_callback("node-added", self.__external_modify)
-        self.tree.register_callback("node-modified", self.__external_modify)
-        self.tree.register_callback("node-deleted", self.__external_modify)
+        modify = functools.partial(self.__in_round, self.__external_modify)
+        self.tree.register_callback("node-added", modify)
+        self.tree.register_callback("node-modified", modify)
+        self.tree.register_callback("node-deleted", modify)
+        self.tree.register_callback(
+            "subtree-deleted",
+            functools.partial(self.__in_round, self.__external_delete_subtree))
+        self.tree.register_callback(
+            "all-modified",
+            functools.partial(self.__in_round, self.__external_refresh))
+
+        # Nodes whose children are displayed in the lazy mode
+        self.__lazy = lazy
+        self.__expanded = set()
 
         # Filters
         self.__flat = False
+        # Is the view a flat list of nodes under the root? It is updated
+        # by __update_flat() then.
+        self.__flat_list = False
+        # Children are kept ordered by the key, see set_sort_key()
+        self.__sort_key = None
+        self.__sort_reverse = False
         self.applied_filters = []
+        self.__evaluator = And()
         self.fbank = filtersbank
 
         if refresh:
@@ -80,8 +146,14 @@ class FilteredTree(object):
         """ Register a callback for an event.
 
         It is possible to have just one callback for event.
-        @param event: one of added, modified, deleted, reordered
+        @param event: one of added, modified, deleted, subtree-deleted,
+            reordered, changes
         @param func: callback function
+
+        The changes callback gets a list of all events sent during one
+        update of the view, as tuples (event, node_id, path) or
+        (event, node_id, path, neworder). It is called after the other
+        callbacks, once the view is in its final state.
         """
         if event == 'runonce':
             if not node_id:
@@ -101,7 +173,8 @@ class FilteredTree(object):
 
         To call callback, the object must be initialized and function exists.
 
-        @param event: one of added, modified, deleted, reordered, runonce
+        @param event: one of added, modified, deleted, subtree-deleted,
+            reordered, runonce
         @param node_id: node_id parameter for callback function
         @param path: path parameter for callback function
         @param neworder: neworder parameter for reorder callback function
@@ -125,37 +198,383 @@ class FilteredTree(object):
             else:
                 func(node_id, path)
 
+        if self.cllbcks.get('changes', (None, ))[0]:
+            if neworder:
+                self.__changes.append((event, node_id, path, neworder))
+            else:
+                self.__changes.append((event, node_id, path))
+            if not self.__rounds:
+                self.__send_changes()
+
+    def __in_round(self, func, *args):
+        """ Run func as one update of the view
+
+        Events sent by it, including nested rounds, are passed to
+        the changes callback at once when it finishes. """
+        self.__rounds += 1
+        try:
+            return func(*args)
+        finally:
+            self.__rounds -= 1
+            if not self.__rounds:
+                self.__send_changes()
+
+    def __send_changes(self):
+        """ Pass collected changes to the changes callback """
+        changes, self.__changes = self.__changes, []
+        func = self.cllbcks.get('changes', (None, ))[0]
+        if func and changes:
+            func(changes)
+
     # EXTERNAL MODIFICATION ###################################################
     def __external_modify(self, node_id):
-        return self.__update_node(node_id, direction="both")
+        if self.filter_cache:
+            self.__recount_changed(node_id)
+        if self.__flat_list:
+            # Flat filters might depend on descendants of a node
+            node_ids = [node_id]
+            if self.tree.has_node(node_id):
+                node_ids.extend(self.tree.get_ancestors(node_id))
+            self.__update_flat(node_ids)
+            return
+        self.__schedule(node_id, "both")
+        self.__propagate()
+
+    def __external_delete_subtree(self, node_id, removed_ids):
+        """ Remove all displayed nodes of a deleted subtree at once
+
+        Only the topmost displayed instances are unlinked from the rest of
+        the view. The following node-deleted events of single nodes find
+        nothing to update.
+
+        Nodes removed during a batch are sent without node_id. Their
+        children might stay in the tree, those are updated at the end. """
+        removed = set(removed_ids)
+        self.__recount(removed)
+        displayed = [nid for nid in removed_ids if nid in self.nodes]
+        for nid in displayed:
+            for parent_id in list(self.nodes[nid].parents):
+                if parent_id in removed:
+                    continue
+                self.send_remove_tree(nid, parent_id)
+                self.__unlink(parent_id, nid)
+                self.nodes[nid].parents.remove(parent_id)
+                self.__invalidate_paths(nid)
+
+        orphans = []
+        for nid in displayed:
+            self.__invalidate_paths(nid)
+            node = self.nodes.pop(nid)
+            for child_id in node.children:
+                if child_id not in removed:
+                    self.nodes[child_id].parents.remove(nid)
+                    if child_id not in orphans:
+                        orphans.append(child_id)
+
+        for child_id in orphans:
+            if child_id in self.nodes:
+                self.__schedule(child_id, "both")
+        self.__propagate()
+
+    def __external_refresh(self, node_id=None):
+        """ Re-evaluate all nodes in one sweep """
+        self.__update_all(send_modified=True)
+
+    def __update_all(self, send_modified):
+        """ Bring the whole view up to date with the tree and filters
+
+        The new state of the view is computed first and only the difference
+        is sent: removed instances from the deepest ones, new instances from
+        the top and modified nodes which stay displayed. Without
+        send_modified, only nodes whose descendants changed are modified.
+        """
+        for counter in self.filter_cache.values():
+            counter['nodes'] = None
+        order = self.tree.get_topological_order()
+        flat_list = self.__flat_list
+        self.__flat_list = False
+
+        lazy = self.__lazy and not self.__flat
+        new_parents = {}
+        for nid in order:
+            if not self.__passes_filters(nid):
+                continue
+            parents = []
+            hidden_parent = False
+            if not self.__flat:
+                for parent_id in self.tree.get_node(nid).get_parents():
+                    if parent_id not in new_parents:
+                        hidden_parent = (hidden_parent or lazy and
+                                         self.__passes_filters(parent_id))
+                    elif not lazy or parent_id in self.__expanded:
+                        parents.append(parent_id)
+                    else:
+                        hidden_parent = True
+            if not parents:
+                if hidden_parent:
+                    # All its displayed parents are collapsed
+                    continue
+                parents = [self.root_id]
+            new_parents[nid] = parents
+
+        if len(self.nodes) == 1:
+            # The view is empty, there is no difference to compute
+            self.__build_all(order, new_parents)
+            self.__flat_list = self.__flat
+            return
+
+        if self.__flat and flat_list:
+            self.__update_flat(
+                list(self.nodes[self.root_id].children) +
+                [nid for nid in new_parents if nid not in self.nodes],
+                send_modified)
+            self.__flat_list = True
+            return
+
+        # Parents are unlinked before their children, the instances of
+        # a child under a removed parent are already gone by then.
+        # The order of the current view is used, it can have nodes which
+        # are not in the tree anymore.
+        changed = set()
+        old_order = self.__get_topological_order()
+        for nid in old_order:
+            stay = new_parents.get(nid, ())
+            for parent_id in list(self.nodes[nid].parents):
+                if parent_id not in stay:
+                    self.send_remove_tree(nid, parent_id)
+                    self.__unlink(parent_id, nid)
+                    self.nodes[nid].parents.remove(parent_id)
+                    self.__invalidate_paths(nid)
+                    changed.add(parent_id)
+
+        for nid in old_order:
+            if nid not in new_parents:
+                self.__invalidate_paths(nid)
+                self.nodes.pop(nid)
+        kept = set(self.nodes)
+
+        # Parents are linked before their children, so that every instance
+        # is added exactly once
+        for nid in order:
+            if nid not in new_parents:
+                continue
+            if nid not in self.nodes:
+                self.nodes[nid] = _ViewNode()
+            for parent_id in new_parents[nid]:
+                if parent_id in self.nodes[nid].parents:
+                    continue
+                self.nodes[nid].parents.append(parent_id)
+                self.__link(parent_id, nid)
+                self.__invalidate_paths(nid)
+                self.send_add_tree(nid, parent_id)
+                changed.add(parent_id)
+
+        # Ancestors of changed nodes are modified as well
+        stack = list(changed)
+        while stack:
+            nid = stack.pop()
+            if nid in self.nodes:
+                for parent_id in self.nodes[nid].parents:
+                    if parent_id not in changed:
+                        changed.add(parent_id)
+                        stack.append(parent_id)
+
+        for nid in order:
+            if nid in kept and (send_modified or nid in changed):
+                if send_modified and self.__sort_key:
+                    self.__update_position(nid)
+                for path in self.get_paths_for_node(nid):
+                    self.callback('modified', nid, path)
+        self.__flat_list = self.__flat
+
+    def __update_flat(self, node_ids, send_modified=True):
+        """ Update nodes of a flat view
+
+        All displayed nodes are children of the root, so only the list of
+        them is updated. There is no propagation to relatives. """
+        for node_id in node_ids:
+            if node_id == self.root_id:
+                continue
+            current_display = node_id in self.nodes
+            new_display = self.__is_displayed(node_id)
+            self.__recount((node_id, ))
+            if current_display and new_display:
+                if send_modified:
+                    if self.__sort_key:
+                        self.__update_position(node_id)
+                    self.callback('modified', node_id, (node_id, ))
+            elif new_display:
+                self.nodes[node_id] = _ViewNode([self.root_id])
+                self.__link(self.root_id, node_id)
+                self.__invalidate_paths(node_id)
+                self.callback('added', node_id, (node_id, ))
+            elif current_display:
+                self.__invalidate_paths(node_id)
+                node = self.__unlink_deleted(node_id)
+                self.callback('deleted', node_id, (node_id, ))
+                self.__forget_positions(node_id, node.parents)
+
+    def __build_all(self, order, new_parents):
+        """ Fill an empty view at once and send all instances as added
+
+        Instances are sent in depth-first order, every path comes after
+        the path of its parent. """
+        for nid in order:
+            if nid in new_parents:
+                self.nodes[nid] = _ViewNode(new_parents[nid])
+        for nid in order:
+            if nid in new_parents:
+                for parent_id in new_parents[nid]:
+                    self.__add_child(parent_id, nid)
+        # Children are counted before their parents
+        for nid in reversed([self.root_id] + order):
+            if nid in self.nodes:
+                node = self.nodes[nid]
+                node.n_descendants = sum(
+                    1 + self.nodes[child_id].n_descendants
+                    for child_id in node.children)
+
+        stack = [(nid, (nid, ))
+                 for nid in reversed(self.nodes[self.root_id].children)]
+        while stack:
+            nid, path = stack.pop()
+            self.callback('added', nid, path)
+            for child_id in reversed(self.nodes[nid].children):
+                stack.append((child_id, path + (child_id, )))
+
+    def __get_topological_order(self):
+        """ Return displayed nodes, every node comes after its parents """
+        n_parents = {}
+        for node_id, node in self.nodes.items():
+            n_parents[node_id] = len(node.parents)
+
+        queue = [self.root_id]
+        for node_id in queue:
+            for child_id in self.nodes[node_id].children:
+                n_parents[child_id] -= 1
+                if n_parents[child_id] == 0:
+                    queue.append(child_id)
+        return queue[1:]
+
+    def __schedule(self, node_id, direction, urgent=False):
+        """ Add node to the worklist of __propagate()
+
+        Nodes are updated from the least deep ones, so that parents are
+        up to date before their children. Updates of parents because of
+        their children ("up") go after all other updates, from the deepest
+        ones, so that a parent is updated once for all its changed
+        children. An urgent update is needed before a child can be added.
+
+        A node already waiting is updated only once, in both directions if
+        they differ. """
+        if node_id == self.root_id:
+            return
+
+        depth = len(self.tree.get_ancestors(node_id))
+        if direction == "up" and not urgent:
+            key = (1, -depth)
+        else:
+            key = (0, depth)
+
+        pending = self.__pending.get(node_id)
+        if pending is not None:
+            pending_direction, pending_key = pending
+            if pending_direction != direction:
+                direction = "both"
+            if pending_key <= key:
+                self.__pending[node_id] = (direction, pending_key)
+                return
+
+        self.__pending[node_id] = (direction, key)
+        heapq.heappush(
+            self.__worklist, (key, next(self.__worklist_order), node_id))
+
+    def __propagate(self):
+        """ Update scheduled nodes and all nodes affected by them
+
+        Changes caused by callbacks during the propagation are added to
+        the running worklist. """
+        if self.__propagating:
+            return
+
+        self.__propagating = True
+        updated = 0
+        try:
+            while self.__worklist:
+                key, order, node_id = heapq.heappop(self.__worklist)
+                pending = self.__pending.get(node_id)
+                if pending is None or pending[1] != key:
+                    # The node was rescheduled with a higher priority
+                    continue
+                del self.__pending[node_id]
+                self.__update_node(node_id, pending[0])
+                updated += 1
+        finally:
+            self.__propagating = False
+
+        stats = self.__propagation_stats
+        stats['events'] += 1
+        stats['updates'] += updated
+        stats['last'] = updated
+        stats['max'] = max(stats['max'], updated)
+
+    def get_propagation_stats(self):
+        """ Return how many nodes were updated because of external changes
+
+        events - number of propagations
+        updates - number of node updates in all of them
+        last - number of node updates in the last propagation
+        max - the highest number of updates in one propagation
+        """
+        return dict(self.__propagation_stats)
+
+    def memory_usage(self):
+        """ Return approximate number of bytes used by caches of the view
+
+        Node ids are shared with MainTree and are not counted. """
+        size = sys.getsizeof(self.nodes)
+        for node in self.nodes.values():
+            size += sys.getsizeof(node)
+
+        size += sys.getsizeof(self.cache_paths)
+        for paths in self.cache_paths.values():
+            size += sys.getsizeof(paths)
+            for path in paths:
+                size += sys.getsizeof(path)
+        size += sys.getsizeof(self.cache_path_sets)
+        for path_set in self.cache_path_sets.values():
+            size += sys.getsizeof(path_set)
+
+        for counter in self.filter_cache.values():
+            for value in (counter['nodes'], counter['dirty']):
+                if value is not None:
+                    size += sys.getsizeof(value)
+        return size
 
     def __update_node(self, node_id, direction):
-        '''update the node node_id and propagate the
-        change in direction (up|down|both) '''
+        '''update the node node_id and schedule its relatives in
+        direction (up|down|both) '''
 
         if node_id == self.root_id:
-            return None
+            return
 
         current_display = self.is_displayed(node_id)
         new_display = self.__is_displayed(node_id)
 
-        for fcname in self.filter_cache:
-            if node_id in self.filter_cache[fcname]['nodes']:
-                self.filter_cache[fcname]['nodes'].remove(node_id)
-                self.filter_cache[fcname]['count'] = len(
-                    self.filter_cache[fcname]['nodes'])
-
-        completely_updated = True
+        self.__recount((node_id, ))
+        lazy = self.__lazy and not self.__flat
 
         if not current_display and not new_display:
             # If a task is not displayed and should not be displayed, we
             # should still check its parent because he might not be aware
             # that he has a child
+            if lazy:
+                self.__schedule_moved_children(node_id)
             if self.tree.has_node(node_id):
                 node = self.tree.get_node(node_id)
                 for parent in node.get_parents():
-                    self.__update_node(parent, "up")
-            return completely_updated
+                    self.__schedule(parent, "up")
+            return
         elif not current_display and new_display:
             action = 'added'
         elif current_display and not new_display:
@@ -163,35 +582,47 @@ class FilteredTree(object):
         else:
             action = 'modified'
 
-        # Create node info for new node
         if action == 'added':
-            self.nodes[node_id] = {'parents': [], 'children': []}
+            # When using flat filter or a recursive filter, FilteredTree
+            # might not recognize a parent correctly, make sure to check
+            # them. The node waits until its displayed parents are added.
+            waiting = False
+            for parent_id in self.tree.get_node(node_id).get_parents():
+                if parent_id in self.nodes and \
+                        self.__is_displayed(parent_id):
+                    continue
+                if parent_id not in self.nodes and not self.__flat and \
+                        self.__is_displayed(parent_id):
+                    self.__schedule(parent_id, "up", urgent=True)
+                    waiting = True
+                else:
+                    self.__schedule(parent_id, "up")
+            if waiting:
+                self.__schedule(node_id, direction, urgent=True)
+                return
+
+            # Create node info for new node
+            self.nodes[node_id] = _ViewNode()
+            if lazy:
+                self.__schedule_moved_children(node_id)
 
         # Make sure parents are okay if we adding or updating
         if action == 'added' or action == 'modified':
-            current_parents = self.nodes[node_id]['parents']
+            current_parents = self.nodes[node_id].parents
             new_parents = self.__node_parents(node_id)
 
-            # When using flat filter or a recursive filter, FilteredTree
-            # might not recognize a parent correctly, make sure to check them
-            if action == 'added':
-                node = self.tree.get_node(node_id)
-                for parent_id in node.get_parents():
-                    if (parent_id not in new_parents and parent_id not in current_parents):
-                        self.__update_node(parent_id, direction="up")
-
-            # Refresh list of parents after doing checkup once again
-            current_parents = self.nodes[node_id]['parents']
-            new_parents = self.__node_parents(node_id)
-
-            self.nodes[node_id]['parents'] = [
-                parent_id for parent_id in new_parents
-                if parent_id in self.nodes]
-
             remove_from = set(current_parents) - set(new_parents)
             add_to = set(new_parents) - set(current_parents)
             stay = set(new_parents) - set(add_to)
 
+            # Parents are linked one by one so that the cache is consistent
+            # even when updating the parents changes this node again
+            self.nodes[node_id].parents = [
+                parent_id for parent_id in current_parents
+                if parent_id not in remove_from]
+            if remove_from:
+                self.__invalidate_paths(node_id)
+
             # If we are updating a node at the root, we should take care
             # of the root too
             if direction == "down" and self.root_id in add_to:
@@ -199,53 +630,62 @@ class FilteredTree(object):
 
             for parent_id in remove_from:
                 self.send_remove_tree(node_id, parent_id)
-                self.nodes[parent_id]['children'].remove(node_id)
+                self.__unlink(parent_id, node_id)
                 if direction == "both" or direction == "up":
-                    self.__update_node(parent_id, direction="up")
+                    self.__schedule(parent_id, "up")
             # there might be some optimization here
-            for parent_id in add_to:
+            for parent_id in new_parents:
+                if (parent_id not in add_to or
+                        parent_id in self.nodes[node_id].parents):
+                    continue
                 if parent_id in self.nodes:
-                    self.nodes[parent_id]['children'].append(node_id)
+                    self.nodes[node_id].parents.append(parent_id)
+                    self.__link(parent_id, node_id)
+                    self.__invalidate_paths(node_id)
                     self.send_add_tree(node_id, parent_id)
                     if direction == "both" or direction == "up":
-                        self.__update_node(parent_id, direction="up")
+                        self.__schedule(parent_id, "up")
                 else:
-                    completely_updated = False
                     raise Exception("We have a parent not in the ViewTree")
             # We update all the other parents
             if direction == "both" or direction == "up":
                 for parent_id in stay:
-                    self.__update_node(parent_id, direction="up")
+                    self.__schedule(parent_id, "up")
             # We update the node itself
             # Why should we call the callback only for modify?
             if action == 'modified':
+                if self.__sort_key:
+                    self.__update_position(node_id)
                 for path in self.get_paths_for_node(node_id):
                     self.callback(action, node_id, path)
 
             # We update the children
-            current_children = self.nodes[node_id]['children']
+            current_children = self.nodes[node_id].children
             new_children = self.__node_children(node_id)
             if direction == "both" or direction == "down":
                 for cid in new_children:
                     if cid not in current_children:
-                        self.__update_node(cid, direction="down")
+                        self.__schedule(cid, "down")
 
         elif action == 'deleted':
             paths = self.get_paths_for_node(node_id)
-            children = list(reversed(self.nodes[node_id]['children']))
+            children = list(reversed(self.nodes[node_id].children))
             for child_id in children:
                 self.send_remove_tree(child_id, node_id)
-                self.nodes[child_id]['parents'].remove(node_id)
-                self.__update_node(child_id, direction="down")
-
-            node = self.nodes.pop(node_id)
+                self.__unlink(node_id, child_id)
+                self.nodes[child_id].parents.remove(node_id)
+                self.__invalidate_paths(child_id)
+                self.__schedule(child_id, "down")
+
+            self.__invalidate_paths(node_id)
+            node = self.__unlink_deleted(node_id)
+            for parent_id in node.parents:
+                self.__schedule(parent_id, "up")
+            if lazy:
+                self.__schedule_moved_children(node_id)
             for path in paths:
                 self.callback(action, node_id, path)
-
-            # Remove node from cache
-            for parent_id in node['parents']:
-                self.nodes[parent_id]['children'].remove(node_id)
-                self.__update_node(parent_id, direction="up")
+            self.__forget_positions(node_id, node.parents)
 
             # We update parents who are not displayed
             # If the node is only hidden and still exists in the tree
@@ -253,26 +693,30 @@ class FilteredTree(object):
                 node = self.tree.get_node(node_id)
                 for parent in node.get_parents():
                     if parent not in self.nodes:
-                        self.__update_node(parent, direction="up")
-
-        return completely_updated
+                        self.__schedule(parent, "up")
 
     def send_add_tree(self, node_id, parent_id):
         paths = self.get_paths_for_node(parent_id)
         queue = [(node_id, (node_id, ))]
 
-        while queue != []:
-            node_id, relative_path = queue.pop(0)
-
+        for node_id, relative_path in queue:
             for start_path in paths:
                 path = start_path + relative_path
                 self.callback('added', node_id, path)
 
-            for child_id in self.nodes[node_id]['children']:
+            for child_id in self.nodes[node_id].children:
                 queue.append((child_id, relative_path + (child_id, )))
 
     def send_remove_tree(self, node_id, parent_id):
         paths = self.get_paths_for_node(parent_id)
+
+        # Announce removal of whole subtrees first, so that views can
+        # remove them at once. Every node is still deleted below.
+        if self.nodes[node_id].children:
+            for start_path in paths:
+                self.callback('subtree-deleted', node_id,
+                              start_path + (node_id, ))
+
         stack = [(node_id, (node_id, ), True)]
 
         while stack != []:
@@ -280,7 +724,7 @@ class FilteredTree(object):
 
             if first_time:
                 stack.append((node_id, relative_path, False))
-                for child_id in self.nodes[node_id]['children']:
+                for child_id in self.nodes[node_id].children:
                     stack.append(
                         (child_id, relative_path + (child_id, ), True))
 
@@ -291,24 +735,23 @@ class FilteredTree(object):
 
     def test_validity(self):
         for node_id in self.nodes:
-            for parent_id in self.nodes[node_id]['parents']:
-                assert node_id in self.nodes[parent_id]['children'], (
+            for parent_id in self.nodes[node_id].parents:
+                assert node_id in self.nodes[parent_id].children, (
                     "Node '{}' is not in children of '{}'".format(
                         node_id, parent_id))
 
-            if self.nodes[node_id]['parents'] == []:
+            if self.nodes[node_id].parents == []:
                 assert node_id == self.root_id, (
                     "Node '{}' does not have parents".format(node_id))
 
-            for parent_id in self.nodes[node_id]['children']:
-                assert node_id in self.nodes[parent_id]['parents'], (
+            for parent_id in self.nodes[node_id].children:
+                assert node_id in self.nodes[parent_id].parents, (
                     "Node '{}' is not in parents of '{}'".format(
                         node_id, parent_id))
 
     # OTHER ###################################################################
     def refilter(self):
         # Find out it there is at least one flat filter
-        self.filter_cache = {}
         self.__flat = False
         for filter_name in self.applied_filters:
             filt = self.fbank.get_filter(filter_name)
@@ -316,34 +759,30 @@ class FilteredTree(object):
                 self.__flat = True
                 break
 
-        # Clean the tree
-        for node_id in reversed(self.nodes[self.root_id]['children']):
-            self.send_remove_tree(node_id, self.root_id)
+        # Only the difference between the current and the new state is sent
+        self.__in_round(self.__update_all, False)
 
-        self.nodes = {self.root_id: {'parents': [], 'children': []}}
+    def __is_displayed(self, node_id):
+        """ Should be node displayed regardless of its current status?
 
-        # Build tree again
-        root_node = self.tree.get_root()
-        queue = root_node.get_children()
+        In the lazy mode, a node with displayed parents is shown only if
+        one of them is expanded. """
+        if not self.__passes_filters(node_id):
+            return False
+        if not self.__lazy or self.__flat:
+            return True
 
-        while queue:
-            node_id = queue.pop(0)
-            # FIXME: decide which is the best direction
-            self.__update_node(node_id, direction="both")
-            queue.extend(self.tree.get_node(node_id).get_children())
+        root_level = True
+        for parent_id in self.tree.get_node(node_id).get_parents():
+            if self.__passes_filters(parent_id):
+                if parent_id in self.__expanded and parent_id in self.nodes:
+                    return True
+                root_level = False
+        return root_level
 
-    def __is_displayed(self, node_id):
-        """ Should be node displayed regardless of its current status? """
+    def __passes_filters(self, node_id):
         if node_id and self.tree.has_node(node_id):
-            for filter_name in self.applied_filters:
-                filt = self.fbank.get_filter(filter_name)
-                if filt:
-                    can_be_displayed = filt.is_displayed(node_id)
-                    if not can_be_displayed:
-                        return False
-                else:
-                    return False
-            return True
+            return self.__evaluator.evaluate(self.fbank, node_id)
         else:
             return False
 
@@ -356,11 +795,10 @@ class FilteredTree(object):
         if node_id == self.root_id:
             raise Exception("Requesting children for root node")
 
-        if not self.__flat:
-            if self.tree.has_node(node_id):
-                node = self.tree.get_node(node_id)
-            else:
-                node = None
+        if self.__flat or self.__lazy and node_id not in self.__expanded:
+            node = None
+        elif self.tree.has_node(node_id):
+            node = self.tree.get_node(node_id)
         else:
             node = None
 
@@ -386,6 +824,8 @@ class FilteredTree(object):
         if not self.__flat and self.tree.has_node(node_id):
             node = self.tree.get_node(node_id)
             for parent_id in node.get_parents():
+                if self.__lazy and parent_id not in self.__expanded:
+                    continue
                 if parent_id in self.nodes and self.__is_displayed(parent_id):
                     parents_nodes.append(parent_id)
 
@@ -406,7 +846,7 @@ class FilteredTree(object):
                 child = p[i + 1]
                 par = p[i]
                 if par in self.nodes:
-                    valid = (child in self.nodes[par]['children'])
+                    valid = (child in self.nodes[par].children)
                 else:
                     valid = False
                 i += 1
@@ -415,28 +855,119 @@ class FilteredTree(object):
     def get_paths_for_node(self, node_id):
         if node_id == self.root_id or not self.is_displayed(node_id):
             return [()]
+        elif self.__flat_list:
+            return [(node_id, )]
         else:
-            toreturn = []
-            for parent_id in self.nodes[node_id]['parents']:
-                if parent_id not in self.nodes:
-                    raise Exception("Parent %s does not exists" % parent_id)
-                if node_id not in self.nodes[parent_id]['children']:
-                    # Dump also state of FilteredTree => useful for debugging
-                    s = "\nCurrent tree:\n"
-                    for key in self.nodes:
-                        s += "{}\n\t parents: {}\n\t children: {}\n".format(
-                            key,
-                            str(self.nodes[key]['parents']),
-                            str(self.nodes[key]['children']))
-                    raise Exception(
-                        "{} is not children of {}\n{}".format(
-                            node_id, parent_id, s))
-
-                for parent_path in self.get_paths_for_node(parent_id):
-                    mypath = parent_path + (node_id, )
-                    toreturn.append(mypath)
-            self.cache_paths[node_id] = toreturn
-            return toreturn
+            return list(self.__get_paths(node_id))
+
+    def __get_paths(self, node_id):
+        """ Return cached tuple of paths for a displayed node
+
+        Paths of parents are computed before their children without
+        recursion. """
+        paths = self.cache_paths.get(node_id)
+        if paths is not None:
+            return paths
+
+        stack = [node_id]
+        while stack:
+            current_id = stack[-1]
+            if current_id in self.cache_paths:
+                stack.pop()
+                continue
+
+            parents = self.nodes[current_id].parents
+            missing = [parent_id for parent_id in parents
+                       if parent_id != self.root_id and
+                       parent_id in self.nodes and
+                       parent_id not in self.cache_paths]
+            if missing:
+                stack.extend(missing)
+                continue
+
+            stack.pop()
+            paths = []
+            for parent_id in parents:
+                self.__check_parent(current_id, parent_id)
+                if parent_id == self.root_id:
+                    paths.append((current_id, ))
+                else:
+                    for parent_path in self.cache_paths[parent_id]:
+                        paths.append(parent_path + (current_id, ))
+            self.cache_paths[current_id] = tuple(paths)
+
+        return self.cache_paths[node_id]
+
+    def __check_parent(self, node_id, parent_id):
+        """ Raise exception if the cache is inconsistent """
+        if parent_id not in self.nodes:
+            raise Exception("Parent %s does not exists" % parent_id)
+        if node_id not in self.nodes[parent_id].children:
+            # Dump also state of FilteredTree => useful for debugging
+            s = "\nCurrent tree:\n"
+            for key in self.nodes:
+                s += "{}\n\t parents: {}\n\t children: {}\n".format(
+                    key,
+                    str(self.nodes[key].parents),
+                    str(self.nodes[key].children))
+            raise Exception(
+                "{} is not children of {}\n{}".format(
+                    node_id, parent_id, s))
+
+    def __invalidate_paths(self, node_id):
+        """ Forget cached paths of node_id and its descendants
+
+        It must be called whenever displayed parents of the node change. """
+        stack = [node_id]
+        while stack:
+            node_id = stack.pop()
+            self.cache_path_sets.pop(node_id, None)
+            if self.cache_paths.pop(node_id, None) is None:
+                # Descendants are cached only if their ancestors are
+                continue
+            if node_id in self.nodes:
+                stack.extend(self.nodes[node_id].children)
+
+    def __link(self, parent_id, node_id):
+        """ Add the node to displayed children of the parent and count its
+        instances in the parent and its ancestors """
+        self.__add_child(parent_id, node_id)
+        self.__add_to_counts(parent_id, 1 + self.nodes[node_id].n_descendants)
+
+    def __unlink(self, parent_id, node_id):
+        """ Remove the node from displayed children of the parent, reverse
+        of __link() """
+        self.nodes[parent_id].children.remove(node_id)
+        self.__add_to_counts(
+            parent_id, -1 - self.nodes[node_id].n_descendants)
+
+    def __add_to_counts(self, node_id, delta):
+        """ Change numbers of descendants of the node and its ancestors
+
+        An ancestor is changed once for every path to the node, as it has
+        the changed instances below every one of them. """
+        stack = [node_id]
+        while stack:
+            node = self.nodes[stack.pop()]
+            node.n_descendants += delta
+            stack.extend(node.parents)
+
+    def __unlink_deleted(self, node_id):
+        """ Remove a deleted node from the view and return its record
+
+        The node is unlinked from its parents before its deletion is sent,
+        so that callbacks see a consistent view. Its former positions are
+        kept for node_position() until __forget_positions(). """
+        node = self.nodes[node_id]
+        for parent_id in node.parents:
+            self.__deleted_positions[(parent_id, node_id)] = \
+                self.nodes[parent_id].children.index(node_id)
+            self.__unlink(parent_id, node_id)
+        return self.nodes.pop(node_id)
+
+    def __forget_positions(self, node_id, parents):
+        for parent_id in parents:
+            self.__deleted_positions.pop((parent_id, node_id), None)
 
     def print_tree(self, string=False):
         """ Representation of tree in FilteredTree
@@ -453,7 +984,7 @@ class FilteredTree(object):
 
             output += prefix + str(node_id) + '\n'
 
-            for child_id in reversed(self.nodes[node_id]['children']):
+            for child_id in reversed(self.nodes[node_id].children):
                 stack.append((child_id, prefix + " "))
 
         output += "_" * 30 + "\n"
@@ -476,7 +1007,9 @@ class FilteredTree(object):
         tree. It means that the currently applied filters are also taken into
         account.
         """
-        return len(self.get_nodes(withfilters=withfilters))
+        if withfilters == []:
+            return len(self.nodes) - 1
+        return len(self.__get_counter(withfilters)['nodes'])
 
     def get_nodes(self, withfilters=[]):
         """
@@ -489,69 +1022,365 @@ class FilteredTree(object):
         if withfilters == []:
             # Use current cache
             return self.get_all_nodes()
-        elif len(withfilters) == 1 and withfilters[0] in self.filter_cache:
-            return self.filter_cache[withfilters[0]]['nodes']
         else:
-            # Filter on the current nodes
-            filters = []
-            for filter_name in withfilters:
-                filt = self.fbank.get_filter(filter_name)
-                if filt:
-                    filters.append(filt)
-
-            nodes = []
-            for node_id in self.nodes:
-                if node_id == self.root_id:
-                    continue
-
-                displayed = True
-                for filt in filters:
-                    displayed = filt.is_displayed(node_id)
-                    if not displayed:
-                        break
-
-                if displayed:
-                    nodes.append(node_id)
-
-            return nodes
+            # Keep the order of get_all_nodes()
+            nodes = self.__get_counter(withfilters)['nodes']
+            return [node_id for node_id in self.nodes if node_id in nodes]
+
+    def __get_counter(self, withfilters):
+        """ Return up to date counter of displayed nodes passing withfilters
+
+        A counter is created by the first call for a combination of filters
+        and it is maintained afterwards: changed nodes are only marked as
+        dirty and re-evaluated on the next call. The counter is rebuilt
+        when the view is refiltered or when parameters of its filters
+        change. """
+        filters = []
+        for filter_name in withfilters:
+            filt = self.fbank.get_filter(filter_name)
+            if filt:
+                filters.append(filt)
+        versions = tuple((filt, filt.version) for filt in filters)
+
+        key = tuple(withfilters)
+        counter = self.filter_cache.get(key)
+        if counter is None or counter['versions'] != versions:
+            counter = {
+                'nodes': None,
+                'dirty': set(),
+                'versions': versions,
+                'ancestors': any(
+                    filt.depends_on_ancestors() for filt in filters),
+            }
+            self.filter_cache[key] = counter
+
+        if counter['nodes'] is None:
+            candidates = self.nodes
+            counter['nodes'] = set()
+        else:
+            candidates = counter['dirty']
+
+        nodes = counter['nodes']
+        for node_id in candidates:
+            if node_id == self.root_id or node_id not in self.nodes:
+                nodes.discard(node_id)
+                continue
+            for filt in filters:
+                if not filt.is_displayed(node_id):
+                    nodes.discard(node_id)
+                    break
+            else:
+                nodes.add(node_id)
+        counter['dirty'] = set()
+        return counter
+
+    def __recount(self, node_ids):
+        """ Mark nodes to be re-evaluated by counters """
+        for counter in self.filter_cache.values():
+            if counter['nodes'] is not None:
+                counter['dirty'].update(node_ids)
+
+    def __recount_changed(self, node_id):
+        """ Mark nodes whose filter results might be changed by node_id
+
+        Like FiltersBank, only the node and its ancestors are re-evaluated,
+        unless a filter depends on ancestors. """
+        if not self.tree.has_node(node_id):
+            self.__recount((node_id, ))
+            return
+
+        affected = [node_id]
+        affected.extend(self.tree.get_ancestors(node_id))
+        self.__recount(affected)
+
+        counters = [counter for counter in self.filter_cache.values()
+                    if counter['ancestors'] and counter['nodes'] is not None]
+        if counters:
+            descendants = set()
+            stack = [node_id]
+            while stack:
+                current_id = stack.pop()
+                for child_id in self.tree.get_node(current_id).children:
+                    if child_id not in descendants:
+                        descendants.add(child_id)
+                        stack.append(child_id)
+            for counter in counters:
+                counter['dirty'].update(descendants)
 
     def get_node_for_path(self, path):
         if not path or path == ():
             return None
         node_id = path[-1]
-        # Both "if" should be benchmarked
-        if path in self.get_paths_for_node(node_id):
+        if node_id == self.root_id or not self.is_displayed(node_id):
+            return None
+
+        if self.__flat_list:
+            return node_id if len(path) == 1 else None
+
+        path_set = self.cache_path_sets.get(node_id)
+        if path_set is None:
+            path_set = frozenset(self.__get_paths(node_id))
+            self.cache_path_sets[node_id] = path_set
+        if path in path_set:
             return node_id
         else:
             return None
 
     def next_node(self, node_id, parent_id):
+        """ Return the next displayed sibling of node_id or None """
+        return self.__sibling(node_id, parent_id, 1)
+
+    def prev_node(self, node_id, parent_id):
+        """ Return the previous displayed sibling of node_id or None """
+        return self.__sibling(node_id, parent_id, -1)
+
+    def __sibling(self, node_id, parent_id, offset):
         if node_id == self.root_id:
             raise Exception("Calling next_node on the root node")
 
         if node_id not in self.nodes:
             raise Exception("Node %s is not displayed" % node_id)
 
-        parents = self.nodes[node_id]['parents']
+        parents = self.nodes[node_id].parents
         if not parent_id:
             parent_id = parents[0]
         elif parent_id not in parents:
             raise Exception(
                 "Node {} does not have parent {}".format(node_id, parent_id))
 
-        index = self.nodes[parent_id]['children'].index(node_id)
-        if index + 1 < len(self.nodes[parent_id]['children']):
-            return self.nodes[parent_id]['children'][index + 1]
+        siblings = self.nodes[parent_id].children
+        index = siblings.index(node_id) + offset
+        if 0 <= index < len(siblings):
+            return siblings[index]
         else:
             return None
 
     def node_all_children(self, node_id=None):
+        """ Return children of a node, it is expanded in the lazy mode """
         if node_id is None:
             node_id = self.root_id
-        return list(self.nodes[node_id]['children'])
+        elif self.__lazy:
+            self.expand_node(node_id)
+        return list(self.nodes[node_id].children)
+
+    def node_children_window(self, node_id, offset, limit=None):
+        """ Return (children, total): at most limit displayed children of
+        the node starting at offset and the number of all of them.
+
+        Only the window is copied. The node is expanded in the lazy mode.
+        """
+        if node_id is None:
+            node_id = self.root_id
+        elif self.__lazy:
+            self.expand_node(node_id)
+        if node_id not in self.nodes:
+            return [], 0
+
+        children = self.nodes[node_id].children
+        if limit is None:
+            end = len(children)
+        else:
+            end = offset + limit
+        return children[offset:end], len(children)
+
+    def node_position(self, node_id, parent_id=None):
+        """ Return position of the node among displayed children of
+        parent_id (the root if None), None if it is not there """
+        if parent_id is None:
+            parent_id = self.root_id
+        if parent_id not in self.nodes:
+            return None
+        try:
+            return self.nodes[parent_id].children.index(node_id)
+        except ValueError:
+            # The node might be announced as deleted right now
+            return self.__deleted_positions.get((parent_id, node_id))
 
     def node_has_child(self, node_id):
-        return len(self.nodes[node_id]['children']) > 0
+        """ Has the node displayed children? In the lazy mode, children of
+        a collapsed node are checked in the tree. """
+        if node_id is None:
+            node_id = self.root_id
+        if self.__lazy and not self.__flat and node_id != self.root_id and \
+                node_id not in self.__expanded:
+            if not self.tree.has_node(node_id):
+                return False
+            for child_id in self.tree.get_node(node_id).get_children():
+                if self.__passes_filters(child_id):
+                    return True
+            return False
+        return len(self.nodes[node_id].children) > 0
+
+    # SORTING #################################################################
+    def set_sort_key(self, key_func, reverse=False):
+        """ Keep children of every displayed node ordered by key_func(node)
+
+        Keys are cached and a node is moved only when its key changes.
+        Nodes with equal keys keep the order in which they were added.
+        Changed orders are sent as reordered. Without key_func, children
+        stay in their current order and new ones are appended. """
+        self.__sort_key = key_func
+        self.__sort_reverse = reverse
+        if key_func:
+            self.__in_round(self.__sort_all)
+
+    def __sort_all(self):
+        """ Compute keys of all displayed nodes and sort their children """
+        for node_id, node in self.nodes.items():
+            if node_id != self.root_id:
+                node.sort_key = self.__sort_key(self.tree.get_node(node_id))
+
+        for node_id in [self.root_id] + self.__get_topological_order():
+            node = self.nodes[node_id]
+            children = node.children
+            if len(children) < 2:
+                continue
+            neworder = sorted(
+                range(len(children)),
+                key=lambda position: self.nodes[children[position]].sort_key,
+                reverse=self.__sort_reverse)
+            if neworder == list(range(len(children))):
+                continue
+            node.children = IndexedList(
+                children[position] for position in neworder)
+            for path in self.get_paths_for_node(node_id):
+                self.callback('reordered', node_id, path, neworder)
+
+    def __add_child(self, parent_id, node_id):
+        """ Add node to children of the parent, at its sorted position if
+        there is a sort key and in the order of the tree otherwise """
+        children = self.nodes[parent_id].children
+        if not self.__sort_key:
+            children.insert(
+                self.__tree_position(parent_id, children, node_id), node_id)
+            return
+
+        node = self.nodes[node_id]
+        if node.sort_key is None:
+            node.sort_key = self.__sort_key(self.tree.get_node(node_id))
+        children.insert(self.__sorted_position(children, node.sort_key),
+                        node_id)
+
+    def __tree_position(self, parent_id, children, node_id):
+        """ Find position for node which keeps children in the order of
+        children of the parent in the tree
+
+        Nodes displayed under the parent without being its children in the
+        tree, e.g. nodes under the root whose parents are hidden, go after
+        the others. New nodes are appended in the tree and usually go last
+        here as well. """
+        if parent_id == self.root_id:
+            tree_children = self.tree.get_root().children
+        elif self.tree.has_node(parent_id):
+            tree_children = self.tree.get_node(parent_id).children
+        else:
+            return len(children)
+
+        last = len(tree_children)
+
+        def rank(child_id):
+            if child_id in tree_children:
+                return tree_children.index(child_id)
+            return last
+
+        key = rank(node_id)
+        if not children or rank(children[-1]) <= key:
+            return len(children)
+
+        low, high = 0, len(children)
+        while low < high:
+            middle = (low + high) // 2
+            if key < rank(children[middle]):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def __sorted_position(self, children, key):
+        """ Find position for key after all children with the same key """
+        low, high = 0, len(children)
+        while low < high:
+            middle = (low + high) // 2
+            other = self.nodes[children[middle]].sort_key
+            if self.__sort_reverse:
+                before = other < key
+            else:
+                before = key < other
+            if before:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def __update_position(self, node_id):
+        """ Move a displayed node among its siblings if its key changed """
+        node = self.nodes[node_id]
+        key = self.__sort_key(self.tree.get_node(node_id))
+        if key == node.sort_key:
+            return
+        node.sort_key = key
+
+        for parent_id in node.parents:
+            children = self.nodes[parent_id].children
+            old_position = children.index(node_id)
+            children.remove(node_id)
+            new_position = self.__sorted_position(children, key)
+            children.insert(new_position, node_id)
+            if new_position == old_position:
+                continue
+            neworder = list(range(len(children)))
+            neworder.insert(new_position, neworder.pop(old_position))
+            for path in self.get_paths_for_node(parent_id):
+                self.callback('reordered', parent_id, path, neworder)
+
+    # LAZY MODE ###############################################################
+    def expand_node(self, node_id):
+        """ Display children of the node in the lazy mode
+
+        Without the lazy mode, all nodes are always expanded. """
+        if not self.__lazy or node_id in self.__expanded:
+            return
+        self.__expanded.add(node_id)
+        if node_id in self.nodes:
+            self.__in_round(self.__update_children, node_id)
+
+    def collapse_node(self, node_id):
+        """ Remove children of the node from the view in the lazy mode
+        """
+        if node_id not in self.__expanded:
+            return
+        self.__expanded.discard(node_id)
+        if node_id in self.nodes:
+            self.__in_round(self.__update_children, node_id)
+
+    def is_expanded(self, node_id):
+        """ Are children of the node displayed? """
+        return not self.__lazy or node_id in self.__expanded
+
+    def __schedule_moved_children(self, node_id):
+        """ Schedule children of the node which should move in the lazy mode
+
+        Children under a collapsed or hidden node are not updated with it,
+        but those without other displayed parents might need to be added
+        at the root level or removed from there. """
+        if not self.tree.has_node(node_id):
+            return
+        for child_id in self.tree.get_node(node_id).get_children():
+            if child_id not in self.nodes:
+                moved = self.__is_displayed(child_id)
+            elif self.__is_displayed(child_id):
+                moved = (set(self.nodes[child_id].parents) !=
+                         set(self.__node_parents(child_id)))
+            else:
+                moved = True
+            if moved:
+                self.__schedule(child_id, "down")
+
+    def __update_children(self, node_id):
+        self.__schedule(node_id, "down")
+        for child_id in self.nodes[node_id].children:
+            self.__schedule(child_id, "down")
+        self.__propagate()
 
     def node_n_children(self, node_id, recursive=False):
         if node_id is None:
@@ -559,24 +1388,19 @@ class FilteredTree(object):
         if node_id not in self.nodes:
             return 0
         if recursive:
-            total = 0
-            # We avoid recursion in a loop
-            # because the dict might be updated in the meantime
-            cids = list(self.nodes[node_id]['children'])
-            for cid in cids:
-                total += self.node_n_children(cid, recursive=True)
-                total += 1  # we count the node itself ofcourse
-            return total
+            return self.nodes[node_id].n_descendants
         else:
-            return len(self.nodes[node_id]['children'])
+            return len(self.nodes[node_id].children)
 
     def node_nth_child(self, node_id, n):
-        return self.nodes[node_id]['children'][n]
+        if node_id is None:
+            node_id = self.root_id
+        return self.nodes[node_id].children[n]
 
     def node_parents(self, node_id):
         if node_id not in self.nodes:
             raise IndexError('Node %s is not displayed' % node_id)
-        parents = list(self.nodes[node_id]['parents'])
+        parents = list(self.nodes[node_id].parents)
         if self.root_id in parents:
             parents.remove(self.root_id)
         return parents
@@ -588,13 +1412,25 @@ class FilteredTree(object):
         in FilteredTree. After that, FilteredTree and TreeModel are
         in the same state
         """
-        for node_id in self.nodes[self.root_id]['children']:
+        self.__in_round(self.__send_current_state)
+
+    def __send_current_state(self):
+        for node_id in self.nodes[self.root_id].children:
             self.send_add_tree(node_id, self.root_id)
 
     # FILTERS #################################################################
     def list_applied_filters(self):
         return list(self.applied_filters)
 
+    def __compile_filters(self):
+        """ Combine applied filters into one evaluator. It reorders them
+        by their cost and selectivity. """
+        self.__evaluator = And(*self.applied_filters)
+
+    def get_filter_order(self):
+        """ Return applied filters in the current order of evaluation """
+        return self.__evaluator.get_order()
+
     def apply_filter(self, filter_name, parameters=None,
                      reset=None, refresh=True):
         """ Apply a new filter to the tree.
@@ -624,6 +1460,7 @@ class FilteredTree(object):
             toreturn = True
         else:
             toreturn = False
+        self.__compile_filters()
 
         if refresh and should_refilter:
             self.refilter()
@@ -638,6 +1475,7 @@ class FilteredTree(object):
         """
         if filter_name in self.applied_filters:
             self.applied_filters.remove(filter_name)
+            self.__compile_filters()
             if refresh:
                 self.refilter()
             return True
@@ -650,5 +1488,6 @@ class FilteredTree(object):
         the main tree.
         """
         self.applied_filters = []
+        self.__compile_filters()
         if refresh:
             self.refilter()
@@ -21,23 +21,94 @@
 filters_bank stores all of GTG's filters in centralized place
 """
 
+import time
+
+
+class FilterProfile(object):
+    """ Statistics of a filter collected while profiling is enabled
+
+    Latencies of the last SAMPLES evaluations are kept for percentiles.
+    """
+
+    SAMPLES = 1000
+
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.passed = 0
+        self.total_time = 0.0
+        self.__samples = []
+
+    def record(self, elapsed, value):
+        """ Record one evaluation of the filter function """
+        if len(self.__samples) < self.SAMPLES:
+            self.__samples.append(elapsed)
+        else:
+            self.__samples[self.calls % self.SAMPLES] = elapsed
+        self.calls += 1
+        self.total_time += elapsed
+        if value:
+            self.passed += 1
+
+    def percentile(self, percent):
+        """ Return latency below which percent of sampled calls are """
+        if not self.__samples:
+            return 0.0
+        samples = sorted(self.__samples)
+        index = int(round(percent / 100.0 * (len(samples) - 1)))
+        return samples[index]
+
+    def get_report(self):
+        """ Return statistics as a dictionary """
+        calls = self.calls
+        return {
+            'calls': calls,
+            'cache_hits': self.cache_hits,
+            'total_time': self.total_time,
+            'mean': self.total_time / calls if calls else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'pass_ratio': float(self.passed) / calls if calls else 0.0,
+        }
+
 
 class Filter(object):
     def __init__(self, func, req):
         self.func = func
         self.dic = {}
         self.tree = req
+        # Results of func for nodes with the current parameters. The version
+        # is increased whenever parameters change and the cache is dropped.
+        self.version = 0
+        self.cache = {}
+        # FilterProfile while profiling is enabled in FiltersBank
+        self.profile = None
 
     def set_parameters(self, dic):
         if dic:
             self.dic = dic
+            self.version += 1
+            self.cache = {}
 
     def is_displayed(self, node_id):
+        try:
+            value = self.cache[node_id]
+        except KeyError:
+            pass
+        else:
+            if self.profile is not None:
+                self.profile.cache_hits += 1
+            return value
+
         if self.tree.has_node(node_id):
             task = self.tree.get_node(node_id)
         else:
             return False
 
+        if self.profile is not None:
+            start = time.perf_counter()
+
         if self.dic:
             value = self.func(task, parameters=self.dic)
         else:
@@ -46,8 +117,18 @@ class Filter(object):
         if 'negate' in self.dic and self.dic['negate']:
             value = not value
 
+        if self.profile is not None:
+            self.profile.record(time.perf_counter() - start, value)
+
+        self.cache[node_id] = value
         return value
 
+    def forget(self, node_ids):
+        """ Drop cached results of nodes """
+        cache = self.cache
+        for node_id in node_ids:
+            cache.pop(node_id, None)
+
     def get_parameters(self, param):
         return self.dic.get(param, None)
 
@@ -55,6 +136,186 @@ class Filter(object):
         """ Should be the final list flat """
         return self.get_parameters('flat')
 
+    def depends_on_ancestors(self):
+        """ Does the result for a node depend on its ancestors?
+
+        Set by the parameter 'ancestors'. Cached results of descendants of
+        a changed node are dropped then. """
+        return self.get_parameters('ancestors')
+
+
+class FilterExpression(object):
+    """ Combination of named filters from FiltersBank
+
+    Operands are names of filters or other expressions. A missing filter
+    does not display any node. """
+
+    def evaluate(self, bank, node_id):
+        """ Should node_id be displayed? """
+        raise NotImplementedError
+
+    def get_names(self):
+        """ Return set of names of filters used by the expression """
+        names = set()
+        for operand in self.operands:
+            if isinstance(operand, FilterExpression):
+                names.update(operand.get_names())
+            else:
+                names.add(operand)
+        return names
+
+    def __repr__(self):
+        return "{}({})".format(
+            self.__class__.__name__,
+            ", ".join(repr(operand) for operand in self.operands))
+
+
+def _evaluate(operand, bank, node_id):
+    if isinstance(operand, FilterExpression):
+        return operand.evaluate(bank, node_id)
+    filt = bank.get_filter(operand)
+    return bool(filt and filt.is_displayed(node_id))
+
+
+class Not(FilterExpression):
+    """ Nodes which are not displayed by the operand """
+
+    def __init__(self, operand):
+        self.operands = (operand, )
+
+    def evaluate(self, bank, node_id):
+        return not _evaluate(self.operands[0], bank, node_id)
+
+
+class _Junction(FilterExpression):
+    """ Operands are evaluated until one of them gives the decisive value
+
+    The order of evaluation is adapted from time to time: operands which
+    are cheap and often decisive go first. Only a sample of evaluations
+    is timed. Statistics are halved after every reordering to follow
+    changes in the tree. """
+
+    DECISIVE = None
+    # Number of evaluations between two reorderings
+    REORDER_EVERY = 512
+    # Every n-th evaluation is timed
+    TIME_EVERY = 16
+
+    def __init__(self, *operands):
+        self.operands = operands
+        # [operand, time spent, timed calls, calls, decisive results]
+        self.__entries = [[operand, 0.0, 0, 0, 0] for operand in operands]
+        self.__evaluations = 0
+
+    def evaluate(self, bank, node_id):
+        decisive = self.DECISIVE
+        entries = self.__entries
+        if not entries:
+            return not decisive
+        elif len(entries) == 1:
+            return _evaluate(entries[0][0], bank, node_id)
+
+        self.__evaluations += 1
+        if self.__evaluations % self.TIME_EVERY == 0:
+            if self.__evaluations >= self.REORDER_EVERY:
+                self.__reorder()
+            return self.__evaluate_timed(bank, node_id)
+
+        for entry in entries:
+            entry[3] += 1
+            if _evaluate(entry[0], bank, node_id) == decisive:
+                entry[4] += 1
+                return decisive
+        return not decisive
+
+    def __evaluate_timed(self, bank, node_id):
+        decisive = self.DECISIVE
+        for entry in self.__entries:
+            start = time.perf_counter()
+            value = _evaluate(entry[0], bank, node_id)
+            entry[1] += time.perf_counter() - start
+            entry[2] += 1
+            entry[3] += 1
+            if value == decisive:
+                entry[4] += 1
+                return decisive
+        return not decisive
+
+    def get_order(self):
+        """ Return operands in the current order of evaluation """
+        return [entry[0] for entry in self.__entries]
+
+    def __reorder(self):
+        def expected_cost(entry):
+            operand, spent, timed, calls, decisive = entry
+            # Smoothed, an operand which was never called goes first
+            return (spent / (timed + 1)) * (calls + 2) / (decisive + 1)
+
+        self.__entries.sort(key=expected_cost)
+        for entry in self.__entries:
+            entry[1] /= 2
+            for i in (2, 3, 4):
+                entry[i] //= 2
+        self.__evaluations = 0
+
+
+class And(_Junction):
+    """ Nodes displayed by all operands """
+    DECISIVE = False
+
+
+class Or(_Junction):
+    """ Nodes displayed by at least one of operands """
+    DECISIVE = True
+
+
+class ExpressionFilter(Filter):
+    """ Filter defined by FilterExpression over other filters
+
+    Results are not cached here, the filters used by the expression cache
+    theirs. The version follows their versions. """
+
+    def __init__(self, expression, bank):
+        self.expression = expression
+        self.bank = bank
+        self.own_version = 0
+        Filter.__init__(self, None, bank.tree)
+
+    @property
+    def version(self):
+        versions = [self.own_version]
+        for name in sorted(self.expression.get_names()):
+            filt = self.bank.get_filter(name)
+            versions.append((name, filt.version if filt else None))
+        return tuple(versions)
+
+    @version.setter
+    def version(self, value):
+        self.own_version = value
+
+    def set_parameters(self, dic):
+        if dic:
+            self.dic = dic
+            self.own_version += 1
+
+    def is_displayed(self, node_id):
+        if not self.tree.has_node(node_id):
+            return False
+
+        if self.profile is not None:
+            start = time.perf_counter()
+
+        value = self.expression.evaluate(self.bank, node_id)
+        if self.dic.get('negate'):
+            value = not value
+
+        if self.profile is not None:
+            self.profile.record(time.perf_counter() - start, value)
+        return value
+
+    def forget(self, node_ids):
+        pass
+
 
 class FiltersBank(object):
     """
@@ -73,6 +334,63 @@ class FiltersBank(object):
         self.tree = tree
         self.available_filters = {}
         self.custom_filters = {}
+        self.__profiling = False
+
+        # Cached results of filters are dropped before views are updated.
+        # Filters might look at descendants of the node, so results of its
+        # ancestors are dropped as well. Results of descendants are dropped
+        # only for filters depending on ancestors, see
+        # Filter.depends_on_ancestors().
+        self.tree.register_callback('node-added', self.__node_changed)
+        self.tree.register_callback('node-modified', self.__node_changed)
+        self.tree.register_callback('node-deleted', self.__node_changed)
+        self.tree.register_callback('subtree-deleted', self.__nodes_deleted)
+        self.tree.register_callback('batch-changed', self.__nodes_changed)
+        self.tree.register_callback('all-modified', self.__all_changed)
+
+    def __cached_filters(self):
+        filters = list(self.available_filters.values())
+        filters += list(self.custom_filters.values())
+        return [filt for filt in filters if filt.cache]
+
+    def __node_changed(self, node_id):
+        self.__nodes_changed(None, [node_id])
+
+    def __nodes_changed(self, node_id, node_ids):
+        filters = self.__cached_filters()
+        if not filters:
+            return
+
+        affected = set(node_ids)
+        for changed_id in node_ids:
+            if self.tree.has_node(changed_id):
+                affected.update(self.tree.get_ancestors(changed_id))
+
+        inheriting = [filt for filt in filters if filt.depends_on_ancestors()]
+        if inheriting:
+            subtree = set(affected)
+            stack = [changed_id for changed_id in node_ids
+                     if self.tree.has_node(changed_id)]
+            while stack:
+                current_id = stack.pop()
+                for child_id in self.tree.get_node(current_id).children:
+                    if child_id not in subtree:
+                        subtree.add(child_id)
+                        stack.append(child_id)
+
+        for filt in filters:
+            if filt in inheriting:
+                filt.forget(subtree)
+            else:
+                filt.forget(affected)
+
+    def __nodes_deleted(self, node_id, removed_ids):
+        for filt in self.__cached_filters():
+            filt.forget(removed_ids)
+
+    def __all_changed(self, node_id=None):
+        for filt in self.__cached_filters():
+            filt.cache = {}
 
     ##########################################
 
@@ -100,13 +418,24 @@ class FiltersBank(object):
         Adds a filter to the filter bank
         Return True if the filter was added
         Return False if the filter_name was already in the bank
+
+        filter_func can be a FilterExpression, e.g.
+        And('active', Not('closed')), which combines filters of the bank.
         """
         if filter_name not in self.list_filters():
             if filter_name.startswith('!'):
                 filter_name = filter_name[1:]
+            elif isinstance(filter_func, FilterExpression):
+                if filter_name in filter_func.get_names():
+                    raise ValueError(
+                        "Filter {} cannot use itself".format(filter_name))
+                filter_obj = ExpressionFilter(filter_func, self)
+                filter_obj.set_parameters(parameters)
             else:
                 filter_obj = Filter(filter_func, self.tree)
                 filter_obj.set_parameters(parameters)
+            if self.__profiling:
+                filter_obj.profile = FilterProfile()
             self.custom_filters[filter_name] = filter_obj
             return True
         else:
@@ -126,3 +455,49 @@ class FiltersBank(object):
                 return False
         else:
             return False
+
+    # PROFILING ###############################################################
+    def set_profiling(self, enabled=True):
+        """ Start or stop collecting statistics of filters
+
+        Starting profiling again drops the collected statistics. """
+        self.__profiling = enabled
+        for filter_name in self.list_filters():
+            filt = self.get_filter(filter_name)
+            filt.profile = FilterProfile() if enabled else None
+
+    def get_profile(self):
+        """ Return statistics of filters, the most expensive first
+
+        Every item is a dictionary with name of the filter, number of
+        calls of its function, cache_hits, total_time, mean, p50, p90 and
+        p99 latencies in seconds and pass_ratio of calls. """
+        report = []
+        for filter_name in self.list_filters():
+            filt = self.get_filter(filter_name)
+            if filt.profile is not None:
+                item = filt.profile.get_report()
+                item['name'] = filter_name
+                report.append(item)
+        report.sort(key=lambda item: item['total_time'], reverse=True)
+        return report
+
+    def print_profile(self, string=False):
+        """ Print statistics of filters as a table
+
+        @param string: if set, instead of printing, return string for printing.
+        """
+        output = "{:<20} {:>8} {:>8} {:>10} {:>10} {:>10} {:>6}\n".format(
+            "filter", "calls", "hits", "total ms", "p50 us", "p99 us", "pass")
+        for item in self.get_profile():
+            output += (
+                "{:<20} {:>8} {:>8} {:>10.2f} {:>10.1f} {:>10.1f} "
+                "{:>6.2f}\n").format(
+                item['name'], item['calls'], item['cache_hits'],
+                item['total_time'] * 1e3, item['p50'] * 1e6,
+                item['p99'] * 1e6, item['pass_ratio'])
+
+        if string:
+            return output
+        else:
+            print(output)
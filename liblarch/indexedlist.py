@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Liblarch - a library to handle directed acyclic graphs
+# Copyright (c) 2011-2012 - Lionel Dricot & Izidor Matušov
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+
+class IndexedList(object):
+    """ Ordered list of unique items with fast lookups
+
+    It behaves like a list of node_ids (items are appended or inserted
+    at a position) but membership test is done on a dictionary and index
+    lookups use stored positions.
+
+    Removing or inserting an item does not renumber the following items
+    immediately. Their stored positions are only hints: the real position
+    is at most the number of removals lower and the number of insertions
+    higher. The positions are renumbered in one pass after too many
+    changes, more of them are tolerated in long lists.
+    """
+
+    __slots__ = ('_items', '_index', '_removed', '_inserted', '_stale_from')
+
+    # How many changes are tolerated before the positions are renumbered
+    MAX_STALE = 32
+
+    def __init__(self, items=()):
+        # Duplicates are dropped, the first occurrence is kept
+        self._items = list(dict.fromkeys(items))
+        self._index = dict(
+            (item, position) for position, item in enumerate(self._items))
+        # Number of removals and insertions since positions were exact.
+        # If any, only positions of items before _stale_from are exact.
+        self._removed = 0
+        self._inserted = 0
+        self._stale_from = 0
+
+    def __repr__(self):
+        return repr(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __reversed__(self):
+        return reversed(self._items)
+
+    def __contains__(self, item):
+        return item in self._index
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __eq__(self, other):
+        if isinstance(other, IndexedList):
+            other = other._items
+        return self._items == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __sizeof__(self):
+        # Items themselves are owned by the caller
+        return (object.__sizeof__(self) + self._items.__sizeof__() +
+                self._index.__sizeof__())
+
+    def append(self, item):
+        """ Add item at the end if it is not in the list yet """
+        if item not in self._index:
+            self._index[item] = len(self._items)
+            self._items.append(item)
+
+    def clear(self):
+        """ Remove all items """
+        self._items = []
+        self._index = {}
+        self._removed = 0
+        self._inserted = 0
+        self._stale_from = 0
+
+    def index(self, item):
+        """ Return position of item or raise ValueError """
+        hint = self._index.get(item)
+        if hint is None:
+            raise ValueError("{} is not in list".format(item))
+
+        changes = self._removed + self._inserted
+        if changes == 0 or hint < self._stale_from:
+            return hint
+
+        if changes > max(self.MAX_STALE, len(self._items) >> 4):
+            self._reindex()
+            return self._index[item]
+
+        start = max(self._stale_from, hint - self._removed)
+        position = self._items.index(item, start, hint + self._inserted + 1)
+        self._index[item] = position
+        return position
+
+    def insert(self, position, item):
+        """ Insert item before position if it is not in the list yet """
+        if item in self._index:
+            return
+        if position >= len(self._items):
+            self.append(item)
+            return
+
+        self._items.insert(position, item)
+        self._index[item] = position
+        if self._removed + self._inserted == 0 or \
+                position < self._stale_from:
+            self._stale_from = position
+        self._inserted += 1
+
+    def remove(self, item):
+        """ Remove item or raise ValueError """
+        position = self.index(item)
+        del self._items[position]
+        del self._index[item]
+        if position < len(self._items):
+            if self._removed + self._inserted == 0 or \
+                    position < self._stale_from:
+                self._stale_from = position
+            self._removed += 1
+
+    def _reindex(self):
+        """ Renumber positions of all items with stale position """
+        start = self._stale_from
+        self._index.update(zip(
+            self._items[start:], range(start, len(self._items))))
+        self._removed = 0
+        self._inserted = 0
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Liblarch - a library to handle directed acyclic graphs
+# Copyright (c) 2011-2012 - Lionel Dricot & Izidor Matušov
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+
+""" Compact binary snapshot of MainTree
+
+The file starts with a header and a table of all node ids, everything
+else refers to the ids by their index in the table. All numbers are
+little-endian unsigned 32-bit integers.
+
+    header          b'LARCHSNP', version
+    strings         count, (length, UTF-8 bytes) * count
+    root children   count, index * count
+    nodes           count, node * count
+    pending         count, (parent index, child index) * count
+
+    node            index, flags (1 byte), number of parents, number of
+                    children, parent index * parents, child index * children
+                    and if the payload flag is set, length and bytes of
+                    the payload
+
+The payload is provided by the application and it is stored as it is.
+"""
+
+import mmap
+import struct
+
+from .indexedlist import IndexedList
+
+MAGIC = b'LARCHSNP'
+VERSION = 1
+
+FLAG_PARENTS_ENABLED = 1
+FLAG_CHILDREN_ENABLED = 2
+FLAG_PAYLOAD = 4
+
+_HEADER = struct.Struct('<8sI')
+_UINT = struct.Struct('<I')
+_NODE = struct.Struct('<IBII')
+
+
+class _StringTable(object):
+    """ Assign indexes to node ids in order of their first use """
+
+    def __init__(self):
+        self.strings = []
+        self.indexes = {}
+
+    def index(self, node_id):
+        index = self.indexes.get(node_id)
+        if index is None:
+            if not isinstance(node_id, str):
+                raise ValueError(
+                    "Snapshot supports only string ids, not {!r}".format(
+                        node_id))
+            index = len(self.strings)
+            self.strings.append(node_id)
+            self.indexes[node_id] = index
+        return index
+
+    def indexes_of(self, node_ids):
+        return [self.index(node_id) for node_id in node_ids]
+
+
+def _pack_list(values):
+    return struct.pack('<I%dI' % len(values), len(values), *values)
+
+
+def save(tree, path, payload=None):
+    """ Write nodes of MainTree into file at path
+
+    @param payload - function returning bytes to store with a node
+        or None
+    """
+    table = _StringTable()
+    for node_id in tree.nodes:
+        table.index(node_id)
+
+    body = []
+    body.append(_pack_list(table.indexes_of(tree.root.children)))
+
+    body.append(_UINT.pack(len(tree.nodes)))
+    for node_id, node in tree.nodes.items():
+        parents = table.indexes_of(node.parents)
+        children = table.indexes_of(node.children)
+        data = payload(node) if payload is not None else None
+
+        flags = 0
+        if node.parents_enabled:
+            flags |= FLAG_PARENTS_ENABLED
+        if node.children_enabled:
+            flags |= FLAG_CHILDREN_ENABLED
+        if data is not None:
+            flags |= FLAG_PAYLOAD
+
+        body.append(_NODE.pack(
+            table.index(node_id), flags, len(parents), len(children)))
+        body.append(struct.pack(
+            '<%dI' % (len(parents) + len(children)), *(parents + children)))
+        if data is not None:
+            body.append(_UINT.pack(len(data)))
+            body.append(data)
+
+    pending = []
+    for parent_id, child_id in tree.pending_relationships:
+        pending.append(table.index(parent_id))
+        pending.append(table.index(child_id))
+    body.append(_UINT.pack(len(pending) // 2))
+    body.append(struct.pack('<%dI' % len(pending), *pending))
+
+    with open(path, 'wb') as snapshot:
+        snapshot.write(_HEADER.pack(MAGIC, VERSION))
+        snapshot.write(_UINT.pack(len(table.strings)))
+        for string in table.strings:
+            encoded = string.encode('utf-8')
+            snapshot.write(_UINT.pack(len(encoded)))
+            snapshot.write(encoded)
+        for part in body:
+            snapshot.write(part)
+
+
+class _Reader(object):
+    """ Read values from a buffer one after another """
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def uint(self):
+        return self.unpack(_UINT)[0]
+
+    def uints(self, count):
+        values = struct.unpack_from('<%dI' % count, self.data, self.offset)
+        self.offset += 4 * count
+        return values
+
+    def raw(self, length):
+        if self.offset + length > len(self.data):
+            raise struct.error("not enough data")
+        value = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return value
+
+
+def load(tree, path, factory):
+    """ Load nodes from file at path into an empty MainTree
+
+    @param factory - function creating a node from node_id and its payload
+        (None if there is none)
+    """
+    with open(path, 'rb') as snapshot:
+        data = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            nodes, root_children, pending = _read(data, factory)
+        except struct.error:
+            raise ValueError("Snapshot {} is truncated".format(path))
+        finally:
+            data.close()
+
+    tree.load_nodes(nodes, root_children, pending)
+
+
+def _read(data, factory):
+    """ Parse snapshot and create nodes """
+    reader = _Reader(data)
+    magic, version = reader.unpack(_HEADER)
+    if magic != MAGIC:
+        raise ValueError("Not a liblarch snapshot")
+    if version != VERSION:
+        raise ValueError("Unsupported snapshot version {}".format(version))
+
+    strings = []
+    for _ in range(reader.uint()):
+        strings.append(reader.raw(reader.uint()).decode('utf-8'))
+
+    root_children = [strings[i] for i in reader.uints(reader.uint())]
+
+    nodes = []
+    for _ in range(reader.uint()):
+        index, flags, n_parents, n_children = reader.unpack(_NODE)
+        relatives = reader.uints(n_parents + n_children)
+        payload = None
+        if flags & FLAG_PAYLOAD:
+            payload = bytes(reader.raw(reader.uint()))
+
+        node = factory(strings[index], payload)
+        node.parents_enabled = bool(flags & FLAG_PARENTS_ENABLED)
+        node.children_enabled = bool(flags & FLAG_CHILDREN_ENABLED)
+        node.parents = IndexedList(
+            strings[i] for i in relatives[:n_parents])
+        node.children = IndexedList(
+            strings[i] for i in relatives[n_parents:])
+        nodes.append(node)
+
+    pending = reader.uints(2 * reader.uint())
+    pending = [(strings[pending[i]], strings[pending[i + 1]])
+               for i in range(0, len(pending), 2)]
+
+    return nodes, root_children, pending
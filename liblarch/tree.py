@@ -17,10 +17,83 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 # -----------------------------------------------------------------------------
 
+from collections import OrderedDict
+import contextlib
+import functools
+
 from . import processqueue
+from .callbacks import CallbackRegistry
 from .treenode import _Node
 
 
+class PendingRelationships(object):
+    """ Relationships waiting for their parent or child to be added
+
+    Relationships are indexed by both parent_id and child_id, therefore
+    looking up and removing relationships of a node does not depend on
+    the number of pending relationships.
+    """
+
+    def __init__(self):
+        self._by_parent = {}
+        self._by_child = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, relationship):
+        parent_id, child_id = relationship
+        return child_id in self._by_parent.get(parent_id, ())
+
+    def __iter__(self):
+        for parent_id, children in list(self._by_parent.items()):
+            for child_id in list(children):
+                yield (parent_id, child_id)
+
+    def add(self, parent_id, child_id):
+        """ Add relationship if it is not pending yet """
+        children = self._by_parent.setdefault(parent_id, OrderedDict())
+        if child_id in children:
+            return
+        children[child_id] = None
+        self._by_child.setdefault(child_id, OrderedDict())[parent_id] = None
+        self._count += 1
+
+    def discard(self, parent_id, child_id):
+        """ Remove relationship if it is pending """
+        children = self._by_parent.get(parent_id)
+        if children is None or child_id not in children:
+            return False
+
+        del children[child_id]
+        if not children:
+            del self._by_parent[parent_id]
+
+        parents = self._by_child[child_id]
+        del parents[parent_id]
+        if not parents:
+            del self._by_child[child_id]
+
+        self._count -= 1
+        return True
+
+    def get_parents(self, child_id):
+        """ Return pending parents of child_id """
+        return list(self._by_child.get(child_id, ()))
+
+    def get_children(self, parent_id):
+        """ Return pending children of parent_id """
+        return list(self._by_parent.get(parent_id, ()))
+
+    def discard_node(self, node_id):
+        """ Remove all pending relationships of node_id """
+        for parent_id in self.get_parents(node_id):
+            self.discard(parent_id, node_id)
+        for child_id in self.get_children(node_id):
+            self.discard(node_id, child_id)
+
+
 class MainTree(object):
     """ Tree which stores and handle all requests """
 
@@ -31,9 +104,20 @@ class MainTree(object):
         """
 
         self.nodes = {}
-        self.pending_relationships = []
+        self.pending_relationships = PendingRelationships()
+
+        # Caches of ancestors, paths and number of paths of nodes. If a node
+        # is in a cache, all its ancestors are in that cache as well.
+        self._ancestors = {}
+        self._paths = {}
+        self._path_counts = {}
 
-        self.__cllbcks = {}
+        self.__cllbcks = CallbackRegistry()
+
+        # Changes collected between begin_update() and end_update()
+        self.__batch_depth = 0
+        self.__batch_changes = OrderedDict()
+        self.__batch_refresh_all = False
 
         self.root_id = 'root'
         self.root = _Node(self.root_id)
@@ -52,31 +136,137 @@ class MainTree(object):
     def register_callback(self, event, func):
         """ Store function and return unique key which can be used to
         unregister the callback later """
-
-        if event not in self.__cllbcks:
-            self.__cllbcks[event] = {}
-
-        callbacks = self.__cllbcks[event]
-        key = 0
-        while key in callbacks:
-            key += 1
-
-        callbacks[key] = func
-        return key
+        return self.__cllbcks.register(event, func)
 
     def deregister_callback(self, event, key):
         """ Remove the callback identifed by key (from register_cllbck) """
-        try:
-            del self.__cllbcks[event][key]
-        except KeyError:
-            pass
+        self.__cllbcks.deregister(event, key)
+
+    def get_callback_counts(self):
+        """ Return number of callbacks registered for every event """
+        return self.__cllbcks.get_counts()
 
-    def _callback(self, event, node_id):
+    def _callback(self, event, node_id, *args):
         """ Inform others about the event """
-        # We copy the dict to not loop on it while it could be modified
-        dic = dict(self.__cllbcks.get(event, {}))
-        for func in dic.values():
-            func(node_id)
+        if self.__batch_depth > 0:
+            # Removed nodes of a subtree are recorded by their node-deleted
+            if event != 'subtree-deleted':
+                self.__record_change(event, node_id)
+            return
+
+        # The registry gives a snapshot which is not changed by callbacks
+        # registered or removed during the loop
+        for key, func in self.__cllbcks.get(event):
+            func(node_id, *args)
+
+    # BATCH UPDATES ###########################################################
+    def begin_update(self):
+        """ Start collecting changes instead of sending them immediately
+
+        Calls can be nested, changes are sent by the outermost end_update().
+
+        Like other requests, calls from other threads are queued. The batch
+        starts before waiting requests and ends after them, so that none of
+        its requests is sent on its own. The queue drops requests equal to
+        waiting ones, every call gets its own partial. """
+        self._queue.push(functools.partial(self._begin_update),
+                         priority="high")
+
+    def end_update(self):
+        """ Send changes collected since begin_update() """
+        self._queue.push(functools.partial(self._end_update), priority="low")
+
+    def _begin_update(self):
+        self.__batch_depth += 1
+
+    def _end_update(self):
+        """ Send changes collected since begin_update()
+
+        Redundant changes are dropped: a node added and then modified is only
+        added, a node modified several times is modified once and a node
+        added and then deleted is not reported by node-deleted. refresh_all()
+        during the batch replaces modifications of single nodes. """
+        if self.__batch_depth == 0:
+            raise Exception("end_update() called without begin_update()")
+
+        self.__batch_depth -= 1
+        if self.__batch_depth > 0:
+            return
+
+        changes = self.__batch_changes
+        self.__batch_changes = OrderedDict()
+        refresh_all = self.__batch_refresh_all
+        self.__batch_refresh_all = False
+
+        if refresh_all:
+            # Listeners rebuild their state from the tree first, added and
+            # deleted nodes are reported for those without a state
+            self._callback('all-modified', None)
+
+        # Deleted nodes go first, other nodes are sent from ancestors to
+        # descendants so that views never see a stale relationship
+        # together with a new one
+        existing = []
+        removed = []
+        short_lived = []
+        for node_id, (existed, deleted) in changes.items():
+            if node_id in self.nodes:
+                existing.append(node_id)
+            elif existed:
+                removed.append(node_id)
+            else:
+                short_lived.append(node_id)
+
+        # Views are updated node by node, but the tree is already in its
+        # final state. Caches depending on it must be dropped first.
+        gone = removed + short_lived
+        if not refresh_all and (existing or gone):
+            self._callback('batch-changed', None, existing + gone)
+
+        # Removed nodes are sent together, so that views do not update
+        # their state with nodes which are going to be removed too. Views
+        # refiltered during the batch might display nodes added and deleted
+        # during it as well.
+        if gone:
+            self._callback('subtree-deleted', None, gone)
+        for node_id in removed:
+            self._callback('node-deleted', node_id)
+
+        for node_id in self._sort_by_depth(existing):
+            existed, deleted = changes[node_id]
+            if not existed:
+                self._callback('node-added', node_id)
+            elif deleted:
+                self._callback('node-deleted', node_id)
+                self._callback('node-added', node_id)
+            elif not refresh_all:
+                self._callback('node-modified', node_id)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """ Context manager around begin_update() and end_update() """
+        self.begin_update()
+        try:
+            yield self
+        finally:
+            self.end_update()
+
+    def _sort_by_depth(self, node_ids):
+        """ Sort nodes so that every node comes after its ancestors """
+        return sorted(
+            node_ids, key=lambda node_id: len(self.get_ancestors(node_id)))
+
+    def __record_change(self, event, node_id):
+        """ Remember the change of node for end_update()
+
+        For every node we store whether it existed before the batch and
+        whether it was deleted during the batch. """
+        change = self.__batch_changes.get(node_id)
+        if change is None:
+            existed = event != 'node-added'
+            self.__batch_changes[node_id] = [existed, event == 'node-deleted']
+        elif event == 'node-deleted':
+            change[1] = True
 
     # INTERFACE FOR HANDLING REQUESTS #########################################
     def add_node(self, node, parent_id=None, priority="low"):
@@ -96,14 +286,18 @@ class MainTree(object):
 
     def refresh_all(self):
         """ Refresh all nodes """
-        for node_id in list(self.nodes.keys()):
-            self.modify_node(node_id)
+        self._queue.push(self._refresh_all)
+
+    def load_nodes(self, nodes, root_children, pending_relationships):
+        self._queue.push(
+            self._load_nodes, nodes, root_children, pending_relationships)
 
     # IMPLEMENTATION OF HANDLING REQUESTS #####################################
     def _create_relationship(self, parent_id, child_id):
         """ Create relationship without any checks """
         parent = self.nodes[parent_id]
         child = self.nodes[child_id]
+        self._invalidate_subtree(child_id)
 
         if child_id not in parent.children:
             parent.children.append(child_id)
@@ -118,6 +312,7 @@ class MainTree(object):
         """ Destroy relationship without any checks """
         parent = self.nodes[parent_id]
         child = self.nodes[child_id]
+        self._invalidate_subtree(child_id)
 
         if child_id in parent.children:
             parent.children.remove(child_id)
@@ -128,25 +323,27 @@ class MainTree(object):
     def _is_circular_relation(self, parent_id, child_id):
         """ Would the new relation be circular?
 
-        Go over every possible ancestors. If one of them is child_id,
-        this would be circular relation.
+        It is circular if child_id is parent_id or one of its ancestors.
         """
+        return parent_id == child_id or self.is_ancestor(child_id, parent_id)
 
-        visited = []
-        ancestors = [parent_id]
-        while ancestors != []:
-            node_id = ancestors.pop(0)
-            if node_id == child_id:
-                return True
-
-            if node_id not in self.nodes:
+    def _invalidate_subtree(self, node_id):
+        """ Forget cached ancestors and paths of node_id and its descendants
+        """
+        caches = (self._ancestors, self._paths, self._path_counts)
+        stack = [node_id]
+        while stack:
+            node_id = stack.pop()
+            cached = False
+            for cache in caches:
+                if cache.pop(node_id, None) is not None:
+                    cached = True
+            if not cached:
+                # Descendants are cached only if their ancestors are
                 continue
 
-            for ancestor_id in self.nodes[node_id].parents:
-                if ancestor_id not in visited:
-                    ancestors.append(ancestor_id)
-
-        return False
+            if node_id in self.nodes:
+                stack.extend(self.nodes[node_id].children)
 
     def _add_node(self, node, parent_id):
         """ Add a node to the tree
@@ -160,9 +357,8 @@ class MainTree(object):
             return False
 
         _Node._set_tree(node, self)
-        for relationship in node.pending_relationships:
-            if relationship not in self.pending_relationships:
-                self.pending_relationships.append(relationship)
+        for rel_parent_id, rel_child_id in node.pending_relationships:
+            self.pending_relationships.add(rel_parent_id, rel_child_id)
         node.pending_relationships = []
 
         self.nodes[node_id] = node
@@ -172,28 +368,32 @@ class MainTree(object):
         children_to_refresh = []
 
         # Build pending relationships
-        for rel_parent_id, rel_child_id in list(self.pending_relationships):
-            # Adding as a child
-            if rel_child_id == node_id and rel_parent_id in self.nodes:
-                if not self._is_circular_relation(rel_parent_id, node_id):
-                    self._create_relationship(rel_parent_id, node_id)
-                    add_to_root = False
-                    parents_to_refresh.append(rel_parent_id)
-                else:
-                    print("Error: Detected pending circular relationship",
-                          rel_parent_id, rel_child_id)
-                self.pending_relationships.remove(
-                    (rel_parent_id, rel_child_id))
-
-            # Adding as a parent
-            if rel_parent_id == node_id and rel_child_id in self.nodes:
-                if not self._is_circular_relation(node_id, rel_child_id):
-                    self._create_relationship(node_id, rel_child_id)
-                    children_to_refresh.append(rel_child_id)
-                else:
-                    print("Error: Detected pending circular relationship",
-                          rel_parent_id, rel_child_id)
-                self.pending_relationships.remove((rel_parent_id, rel_child_id))
+        # Adding as a child
+        for rel_parent_id in self.pending_relationships.get_parents(node_id):
+            if rel_parent_id not in self.nodes:
+                continue
+
+            if not self._is_circular_relation(rel_parent_id, node_id):
+                self._create_relationship(rel_parent_id, node_id)
+                add_to_root = False
+                parents_to_refresh.append(rel_parent_id)
+            else:
+                print("Error: Detected pending circular relationship",
+                      rel_parent_id, node_id)
+            self.pending_relationships.discard(rel_parent_id, node_id)
+
+        # Adding as a parent
+        for rel_child_id in self.pending_relationships.get_children(node_id):
+            if rel_child_id not in self.nodes:
+                continue
+
+            if not self._is_circular_relation(node_id, rel_child_id):
+                self._create_relationship(node_id, rel_child_id)
+                children_to_refresh.append(rel_child_id)
+            else:
+                print("Error: Detected pending circular relationship",
+                      node_id, rel_child_id)
+            self.pending_relationships.discard(node_id, rel_child_id)
 
         # Build relationship with given parent
         if parent_id is not None:
@@ -206,7 +406,7 @@ class MainTree(object):
                 add_to_root = False
                 parents_to_refresh.append(parent_id)
             else:
-                self.pending_relationships.append((parent_id, node_id))
+                self.pending_relationships.add(parent_id, node_id)
 
         # Add at least to root
         if add_to_root:
@@ -227,52 +427,134 @@ class MainTree(object):
         if node_id is None:
             return
 
+        if recursive:
+            self._remove_subtree(node_id)
+            return
+
         # Remove pending relationships with this node
-        for relation in list(self.pending_relationships):
-            if node_id in relation:
-                self.pending_relationships.remove(relation)
+        self.pending_relationships.discard_node(node_id)
 
         node = self.nodes[node_id]
 
         # Handle parents
-        for parent_id in node.parents:
+        for parent_id in list(node.parents):
             self._destroy_relationship(parent_id, node_id)
             self._callback('node-modified', parent_id)
 
         # Handle children
         for child_id in list(node.children):
-            if recursive:
-                self._remove_node(child_id, True)
-            else:
-                self._destroy_relationship(node_id, child_id)
-                self._callback('node-modified', child_id)
-                if self.nodes[child_id].parents == []:
-                    self.root.children.append(child_id)
+            self._destroy_relationship(node_id, child_id)
+            self._callback('node-modified', child_id)
+            if not self.nodes[child_id].parents:
+                self.root.children.append(child_id)
 
         if node_id in self.root.children:
             self.root.children.remove(node_id)
 
+        self._invalidate_subtree(node_id)
         self.nodes.pop(node_id)
         self._callback('node-deleted', node_id)
 
+    def _remove_subtree(self, node_id):
+        """ Remove node with all its descendants without recursion
+
+        Listeners get a single 'subtree-deleted' event with all removed
+        nodes before 'node-deleted' of every single node. Parents outside
+        of the subtree are modified at the end. """
+
+        # Collect descendants before their ancestors, in the same order
+        # as removing them one by one would do
+        removed = []
+        visited = set([node_id])
+        stack = [(node_id, list(reversed(self.nodes[node_id].children)))]
+        while stack:
+            current_id, children = stack[-1]
+            if children:
+                child_id = children.pop()
+                if child_id not in visited and child_id in self.nodes:
+                    visited.add(child_id)
+                    child = self.nodes[child_id]
+                    stack.append((child_id, list(reversed(child.children))))
+            else:
+                stack.pop()
+                removed.append(current_id)
+
+        # Relationships inside of the subtree are dropped at once,
+        # only relationships with the rest of tree are destroyed
+        modified = OrderedDict()
+        for current_id in removed:
+            self.pending_relationships.discard_node(current_id)
+            node = self.nodes[current_id]
+            for parent_id in list(node.parents):
+                if parent_id not in visited:
+                    self._destroy_relationship(parent_id, current_id)
+                    modified[parent_id] = True
+
+        self._invalidate_subtree(node_id)
+        for current_id in removed:
+            node = self.nodes.pop(current_id)
+            node.parents.clear()
+            node.children.clear()
+            if current_id in self.root.children:
+                self.root.children.remove(current_id)
+
+        self._callback('subtree-deleted', node_id, removed)
+        for current_id in removed:
+            self._callback('node-deleted', current_id)
+
+        for parent_id in modified:
+            self._callback('node-modified', parent_id)
+
     def _modify_node(self, node_id):
         """ Force update of a node """
         if node_id != self.root_id and node_id in self.nodes:
             self._callback('node-modified', node_id)
 
+    def _load_nodes(self, nodes, root_children, pending_relationships):
+        """ Fill an empty tree with nodes in one pass
+
+        Relationships are not checked, parents and children of nodes must
+        be already set and consistent. Listeners get a single all-modified.
+
+        @param nodes - list of nodes
+        @param root_children - node_ids of children of root in order
+        @param pending_relationships - list of (parent_id, child_id)
+        """
+        if self.nodes or self.pending_relationships:
+            raise ValueError("Nodes can be loaded only into an empty tree")
+
+        for node in nodes:
+            _Node._set_tree(node, self)
+            node.pending_relationships = []
+            self.nodes[node.get_id()] = node
+
+        for node_id in root_children:
+            self.root.children.append(node_id)
+
+        for parent_id, child_id in pending_relationships:
+            self.pending_relationships.add(parent_id, child_id)
+
+        self._refresh_all()
+
+    def _refresh_all(self):
+        """ Let listeners re-evaluate all nodes in a single sweep """
+        if self.__batch_depth > 0:
+            self.__batch_refresh_all = True
+        else:
+            self._callback('all-modified', None)
+
     def _new_relationship(self, parent_id, child_id):
         """ Creates a new relationship
 
         This method is used mainly from TreeNode"""
 
-        if (parent_id, child_id) in self.pending_relationships:
-            self.pending_relationships.remove((parent_id, child_id))
+        self.pending_relationships.discard(parent_id, child_id)
 
         if not parent_id or not child_id or parent_id == child_id:
             return False
 
         if parent_id not in self.nodes or child_id not in self.nodes:
-            self.pending_relationships.append((parent_id, child_id))
+            self.pending_relationships.add(parent_id, child_id)
             return True
 
         if self._is_circular_relation(parent_id, child_id):
@@ -294,9 +576,7 @@ class MainTree(object):
         """ Remove a relationship
 
         This method is used mainly from TreeNode """
-        for rel_parent, rel_child in list(self.pending_relationships):
-            if rel_parent == parent_id and rel_child == child_id:
-                self.pending_relationships.remove((rel_parent, rel_child))
+        self.pending_relationships.discard(parent_id, child_id)
 
         if not parent_id or not child_id or parent_id == child_id:
             return False
@@ -327,6 +607,76 @@ class MainTree(object):
         else:
             raise ValueError("Node %s is not in the tree" % node_id)
 
+    def _memoize_upwards(self, node_id, cache, compute):
+        """ Fill cache for node_id and all its ancestors
+
+        Parents are processed before their children without recursion.
+        compute(node_id, parents) builds the value of node_id from cached
+        values of its parents. """
+        stack = [node_id]
+        in_progress = set()
+        while stack:
+            current_id = stack[-1]
+            if current_id in cache:
+                stack.pop()
+                continue
+
+            parents = [parent_id
+                       for parent_id in self.nodes[current_id].parents
+                       if parent_id in self.nodes]
+            missing = [parent_id for parent_id in parents
+                       if parent_id not in cache and
+                       parent_id not in in_progress]
+            if missing and current_id not in in_progress:
+                in_progress.add(current_id)
+                stack.extend(missing)
+                continue
+
+            stack.pop()
+            in_progress.discard(current_id)
+            parents = [parent_id for parent_id in parents
+                       if parent_id in cache]
+            cache[current_id] = compute(current_id, parents)
+
+        return cache[node_id]
+
+    def get_ancestors(self, node_id):
+        """ Return frozenset of all ancestors of node_id
+
+        Ancestors are computed once and kept until a relationship
+        in the path to root changes. """
+        ancestors = self._ancestors.get(node_id)
+        if ancestors is not None:
+            return ancestors
+
+        if node_id not in self.nodes:
+            return frozenset()
+
+        def compute(node_id, parents):
+            return frozenset(parents).union(
+                *[self._ancestors[parent_id] for parent_id in parents])
+
+        return self._memoize_upwards(node_id, self._ancestors, compute)
+
+    def is_ancestor(self, ancestor_id, node_id):
+        """ Is ancestor_id a parent, grandparent, ... of node_id? """
+        return ancestor_id in self.get_ancestors(node_id)
+
+    def _get_paths(self, node_id):
+        """ Return cached tuple of all paths for an existing node """
+        paths = self._paths.get(node_id)
+        if paths is not None:
+            return paths
+
+        def compute(node_id, parents):
+            if not parents:
+                return ((node_id, ), )
+            return tuple(path + (node_id, )
+                         for parent_id in parents
+                         for path in self._paths[parent_id])
+
+        return self._memoize_upwards(node_id, self._paths, compute)
+
     def get_node_for_path(self, path):
         """ Convert path into node_id
 
@@ -335,36 +685,84 @@ class MainTree(object):
         if not path or path == ():
             return None
         node_id = path[-1]
-        if path in self.get_paths_for_node(node_id):
+        if node_id not in self.nodes:
+            raise ValueError("Cannot get path for non existing node {}".format(
+                node_id))
+        if path in self._get_paths(node_id):
             return node_id
         else:
             return None
-        return node_id
 
     def get_paths_for_node(self, node_id):
         """ Get all paths for node_id """
         if not node_id or node_id == self.root_id:
             return [()]
         elif node_id in self.nodes:
-            node = self.nodes[node_id]
-            if node.has_parent():
-                paths = []
-                for parent_id in node.get_parents():
-                    if parent_id not in self.nodes:
-                        continue
-                    for path in self.get_paths_for_node(parent_id):
-                        paths.append(path + (node_id, ))
-                return paths
-            else:
-                return [(node_id, )]
+            return list(self._get_paths(node_id))
         else:
             raise ValueError("Cannot get path for non existing node {}".format(
                 node_id))
 
+    def count_paths(self, node_id):
+        """ Return number of paths for node_id without building them
+
+        It is the number of instances of the node in the tree. """
+        if not node_id or node_id == self.root_id:
+            return 1
+        elif node_id not in self.nodes:
+            raise ValueError("Cannot count paths for non existing node {}"
+                             .format(node_id))
+
+        count = self._path_counts.get(node_id)
+        if count is not None:
+            return count
+
+        def compute(node_id, parents):
+            if not parents:
+                return 1
+            return sum(self._path_counts[parent_id] for parent_id in parents)
+
+        return self._memoize_upwards(node_id, self._path_counts, compute)
+
     def get_all_nodes(self):
         """ Return list of all nodes in this tree """
         return list(self.nodes.keys())
 
+    def get_topological_order(self):
+        """ Return list of all nodes where every node comes after all
+        its parents """
+        n_parents = {}
+        queue = []
+        for node_id, node in self.nodes.items():
+            count = 0
+            for parent_id in node.parents:
+                if parent_id in self.nodes:
+                    count += 1
+            n_parents[node_id] = count
+            if count == 0:
+                queue.append(node_id)
+
+        # Nodes are appended when their last parent was placed
+        for node_id in queue:
+            for child_id in self.nodes[node_id].children:
+                if child_id in n_parents:
+                    n_parents[child_id] -= 1
+                    if n_parents[child_id] == 0:
+                        queue.append(child_id)
+        return queue
+
+    def get_stats(self):
+        """ Return statistics about the size of this tree
+
+        pending_relationships is the number of relationships waiting for
+        a parent or a child to be added (the orphan backlog). callbacks
+        is the number of callbacks registered for every event. """
+        return {
+            'nodes': len(self.nodes),
+            'pending_relationships': len(self.pending_relationships),
+            'callbacks': self.get_callback_counts(),
+        }
+
     def next_node(self, node_id, parent_id=None):
         """ Return the next sibling node or None if there is none
 
@@ -372,6 +770,15 @@ class MainTree(object):
         @param parent_id - specify which siblings should be used,
             if task has more parents. If None, random parent will be used
         """
+        return self.__sibling(node_id, parent_id, 1)
+
+    def prev_node(self, node_id, parent_id=None):
+        """ Return the previous sibling node or None if there is none,
+        see next_node() """
+        return self.__sibling(node_id, parent_id, -1)
+
+    def __sibling(self, node_id, parent_id, offset):
+        """ Return sibling at offset from node_id or None """
         if node_id is None:
             raise ValueError('node_id should be different than None')
 
@@ -394,8 +801,8 @@ class MainTree(object):
             error += 'node {} is not a child of {}'.format(node_id, parid)
             raise IndexError(error)
 
-        if parent.get_n_children() > index + 1:
-            return parent.get_nth_child(index + 1)
+        if 0 <= index + offset < parent.get_n_children():
+            return parent.get_nth_child(index + offset)
         else:
             return None
 
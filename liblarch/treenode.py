@@ -17,6 +17,8 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 # -----------------------------------------------------------------------------
 
+from .indexedlist import IndexedList
+
 
 class _Node(object):
     """ Object just for a single node in Tree """
@@ -30,8 +32,8 @@ class _Node(object):
 
         self.parents_enabled = True
         self.children_enabled = True
-        self.parents = []
-        self.children = []
+        self.parents = IndexedList()
+        self.children = IndexedList()
 
         self.tree = None
         self.pending_relationships = []
@@ -80,8 +82,7 @@ class _Node(object):
             if not self.tree:
                 self.pending_relationships.append((parent_id, self.get_id()))
             elif not self.tree.has_node(parent_id):
-                self.tree.pending_relationships.append(
-                    (parent_id, self.get_id()))
+                self.tree.pending_relationships.add(parent_id, self.get_id())
             else:
                 par = self.tree.get_node(parent_id)
                 if par.has_children_enabled():
@@ -96,8 +97,7 @@ class _Node(object):
             elif not self.tree.has_node(parent_id):
                 for p in self.get_parents():
                     self.tree.break_relationship(p, self.get_id())
-                self.tree.pending_relationships.append(
-                    (parent_id, self.get_id()))
+                self.tree.pending_relationships.add(parent_id, self.get_id())
             else:
                 par = self.tree.get_node(parent_id)
                 if par.has_children_enabled():
@@ -160,8 +160,8 @@ class _Node(object):
                     self.pending_relationships.append(
                         (self.get_id(), child_id))
                 elif not self.tree.has_node(child_id):
-                    self.tree.pending_relationships.append(
-                        (self.get_id(), child_id))
+                    self.tree.pending_relationships.add(
+                        self.get_id(), child_id)
                 else:
                     child = self.tree.get_node(child_id)
                     if child.has_parents_enabled():
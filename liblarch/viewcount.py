@@ -26,6 +26,7 @@ class ViewCount(object):
         self.tree.register_callback("node-added", self.__modify)
         self.tree.register_callback("node-modified", self.__modify)
         self.tree.register_callback("node-deleted", self.__delete)
+        self.tree.register_callback("all-modified", self.__modify_all)
 
         self.fbank = fbank
         self.name = name
@@ -89,6 +90,21 @@ class ViewCount(object):
         else:
             self.__delete(nid)
 
+    def __modify_all(self, nid=None):
+        """ Re-evaluate all nodes and call callbacks once """
+        nodes = []
+        for node_id in self.tree.get_all_nodes():
+            displayed = True
+            for filtname in self.applied_filters:
+                filt = self.fbank.get_filter(filtname)
+                displayed &= filt.is_displayed(node_id)
+            if displayed:
+                nodes.append(node_id)
+
+        if set(nodes) != set(self.nodes):
+            self.nodes = nodes
+            self.__callback()
+
     def __delete(self, nid):
         if nid in self.nodes:
             self.nodes.remove(nid)
@@ -19,14 +19,24 @@
 
 import functools
 
+from .callbacks import CallbackRegistry
 from .filteredtree import FilteredTree
 
+# Names of events of FilteredTree for users of ViewTree
+INVIEW_EVENTS = {
+    'added': 'node-added-inview',
+    'deleted': 'node-deleted-inview',
+    'subtree-deleted': 'subtree-deleted-inview',
+    'modified': 'node-modified-inview',
+    'reordered': 'node-children-reordered',
+}
+
 
 # There should be two classes: for static and for dynamic mode
 # There are many conditions, and also we would prevent unallowed modes
 class ViewTree(object):
     def __init__(self, maininterface, maintree, filters_bank,
-                 name=None, refresh=True, static=False):
+                 name=None, refresh=True, static=False, lazy=False):
         """A ViewTree is the interface that should be used to display Tree(s).
 
            In static mode, FilteredTree layer is not created.
@@ -43,12 +53,16 @@ class ViewTree(object):
                            after applying a filter.
            @param static: if True, this is the view of the complete maintree.
                            Filters cannot be added to such a view.
+           @param lazy: if True, only children of expanded nodes are
+                           computed and sent, see expand_node().
         """
         self.maininterface = maininterface
         self.__maintree = maintree
-        self.__cllbcks = {}
+        self.__cllbcks = CallbackRegistry()
         self.__fbank = filters_bank
         self.static = static
+        # Parent of every subscribed window by its key
+        self.__windows = {}
 
         if self.static:
             self._tree = self.__maintree
@@ -62,22 +76,16 @@ class ViewTree(object):
             self.__maintree.register_callback(
                 'node-modified',
                 functools.partial(self.__emit, 'node-modified'))
+            self.__maintree.register_callback(
+                'all-modified', self.__emit_all_modified)
         else:
             self.__ft = FilteredTree(
-                maintree, filters_bank, name=name, refresh=refresh)
+                maintree, filters_bank, name=name, refresh=refresh,
+                lazy=lazy)
             self._tree = self.__ft
-            self.__ft.set_callback(
-                'added',
-                functools.partial(self.__emit, 'node-added-inview'))
-            self.__ft.set_callback(
-                'deleted',
-                functools.partial(self.__emit, 'node-deleted-inview'))
-            self.__ft.set_callback(
-                'modified',
-                functools.partial(self.__emit, 'node-modified-inview'))
-            self.__ft.set_callback(
-                'reordered',
-                functools.partial(self.__emit, 'node-children-reordered'))
+            for ft_event, event in INVIEW_EVENTS.items():
+                self.__ft.set_callback(
+                    ft_event, functools.partial(self.__emit, event))
 
     def queue_action(self, node_id, func, param=None):
         self.__ft.set_callback('runonce', func, node_id=node_id, param=param)
@@ -89,35 +97,124 @@ class ViewTree(object):
     def register_cllbck(self, event, func):
         """ Store function and return unique key which can be used to
         unregister the callback later """
+        return self.__cllbcks.register(event, func)
 
-        if event not in self.__cllbcks:
-            self.__cllbcks[event] = {}
+    def deregister_cllbck(self, event, key):
+        """ Remove the callback identifed by key (from register_cllbck) """
+        self.__cllbcks.deregister(event, key)
 
-        callbacks = self.__cllbcks[event]
-        key = 0
-        while key in callbacks:
-            key += 1
+    def get_callback_counts(self):
+        """ Return number of callbacks registered for every event """
+        return self.__cllbcks.get_counts()
 
-        callbacks[key] = func
-        return key
+    def get_propagation_stats(self):
+        """ Return how many nodes were updated because of changes in
+        MainTree, None for a static view """
+        if self.static:
+            return None
+        return self.__ft.get_propagation_stats()
 
-    def deregister_cllbck(self, event, key):
-        """ Remove the callback identifed by key (from register_cllbck) """
-        try:
-            del self.__cllbcks[event][key]
-        except KeyError:
-            pass
+    def memory_usage(self):
+        """ Return approximate number of bytes used by the view to cache
+        displayed nodes, 0 if there is no cache """
+        if not self.__ft:
+            return 0
+        return self.__ft.memory_usage()
+
+    def set_batched(self, batched=True):
+        """ Enable or disable the batched mode.
+
+        In the batched mode, callbacks of changes-inview get a list of all
+        changes of the view after every update, i.e. after a change in
+        MainTree or after refiltering. Items of the list are tuples
+        (event, node_id, path), or (event, node_id, path, neworder) for
+        node-children-reordered. Instances of a new subtree follow each
+        other, parents first, and can be inserted at once.
+
+        Callbacks of single events are still called as before.
+        """
+        if self.static:
+            raise Exception("WARNING: batched mode is not available "
+                            "for a static tree\n")
+
+        if batched:
+            self.__ft.set_callback('changes', self.__emit_changes)
+        else:
+            self.__ft.set_callback('changes', None)
+
+    def __emit_changes(self, changes):
+        """ Pass changes from FilteredTree with names of ViewTree events
+        """
+        changes = [(INVIEW_EVENTS[change[0]], ) + change[1:]
+                   for change in changes]
+        for key, func in self.__cllbcks.get('changes-inview'):
+            func(changes)
 
     def __emit(self, event, node_id, path=None, neworder=None):
         """ Handle a new event from MainTree or FilteredTree
         by passing it to other objects, e.g. TreeWidget """
-        callbacks = dict(self.__cllbcks.get(event, {}))
-        for func in callbacks.values():
+        for key, func in self.__cllbcks.get(event):
             if neworder:
                 func(node_id, path, neworder)
             else:
                 func(node_id, path)
 
+        if self.__windows and path is not None:
+            if event == 'node-children-reordered':
+                # The whole window of the parent changed
+                parent_id = node_id if path else None
+                for key, func in self.__cllbcks.get(('window', parent_id)):
+                    func(event, node_id, path, None)
+                return
+
+            parent_id = path[-2] if len(path) > 1 else None
+            callbacks = self.__cllbcks.get(('window', parent_id))
+            if callbacks:
+                position = self.__ft.node_position(node_id, parent_id)
+                for key, func in callbacks:
+                    func(event, node_id, path, position)
+
+    def subscribe_window(self, parent_id, offset, limit, func):
+        """ Call func only for changes of rows in the window of children,
+        see get_window(). Return a key for unsubscribe_window().
+
+        func gets (event, node_id, path, position) where position is the
+        index of the node among children of parent_id. Modified nodes are
+        reported inside the window only, added and deleted ones also
+        before it as they shift rows of the window. After
+        node-children-reordered of the parent, position is None.
+        """
+        if self.static:
+            raise Exception("WARNING: windows are not available "
+                            "for a static tree\n")
+
+        key = self.__cllbcks.register(
+            ('window', parent_id),
+            functools.partial(self.__emit_window, offset, limit, func))
+        self.__windows[key] = parent_id
+        return key
+
+    def unsubscribe_window(self, key):
+        """ Stop sending changes of a window from subscribe_window() """
+        parent_id = self.__windows.pop(key, None)
+        self.__cllbcks.deregister(('window', parent_id), key)
+
+    def __emit_window(self, offset, limit, func, event, node_id, path,
+                      position):
+        """ Pass an event to a window callback if it concerns the window
+        """
+        if position is not None:
+            if limit is not None and position >= offset + limit:
+                return
+            if position < offset and event == 'node-modified-inview':
+                return
+        func(event, node_id, path, position)
+
+    def __emit_all_modified(self, node_id=None):
+        """ Static view has no cache, every node is modified """
+        for node_id in self.__maintree.get_all_nodes():
+            self.__emit('node-modified', node_id)
+
     def get_node(self, node_id):
         """ Get a node from MainTree """
         return self.__maintree.get_node(node_id)
@@ -196,6 +293,29 @@ class ViewTree(object):
 
         return self._tree.next_node(node_id, pid)
 
+    def prev_node(self, node_id, pid=None):
+        """ Return the previous node to node_id, see next_node() """
+        return self._tree.prev_node(node_id, pid)
+
+    def get_window(self, parent_id=None, offset=0, limit=None):
+        """ Return (children, total): at most limit displayed children of
+        parent_id (the root if None) from offset and the number of all
+        children. Only the window is copied.
+
+        Changes of the window can be followed by subscribe_window(). """
+        if self.static:
+            if parent_id is None:
+                node = self.__maintree.get_root()
+            elif self.__maintree.has_node(parent_id):
+                node = self.__maintree.get_node(parent_id)
+            else:
+                return [], 0
+            children = node.get_children()
+            end = len(children) if limit is None else offset + limit
+            return children[offset:end], len(children)
+        else:
+            return self.__ft.node_children_window(parent_id, offset, limit)
+
     def node_has_child(self, node_id):
         """ Has the node at least one child? """
         if self.static:
@@ -213,6 +333,24 @@ class ViewTree(object):
         else:
             return self._tree.node_all_children(node_id)
 
+    def expand_node(self, node_id):
+        """ In the lazy mode, compute and send children of the node.
+
+        They are sent by node-added-inview as usual. Only nodes whose
+        ancestors are expanded are displayed. node_has_child() works for
+        collapsed nodes as well. """
+        if not self.static:
+            self.__ft.expand_node(node_id)
+
+    def collapse_node(self, node_id):
+        """ In the lazy mode, remove children of the node from the view """
+        if not self.static:
+            self.__ft.collapse_node(node_id)
+
+    def is_expanded(self, node_id):
+        """ Are children of the node displayed? """
+        return self.static or self.__ft.is_expanded(node_id)
+
     def node_n_children(self, node_id=None, recursive=False):
         """ Return quantity of children of node_id.
         If node_id is None, use the root node.
@@ -265,6 +403,35 @@ class ViewTree(object):
         else:
             return self.__ft.is_displayed(node_id)
 
+    def set_sort_key(self, key_func, reverse=False):
+        """ Keep displayed children of every node sorted by key_func(node).
+
+        The key of a node is computed when it is displayed and again when
+        it is modified, the node is moved only if the key changed. Changed
+        orders are sent by node-children-reordered. Without key_func, the
+        current order is kept and new children are appended.
+        """
+        if self.static:
+            raise Exception("WARNING: a static tree cannot be sorted\n")
+
+        self.__ft.set_sort_key(key_func, reverse)
+
+    def node_position(self, node_id, parent_id=None):
+        """ Return position of the node among displayed children of
+        parent_id (the root if None) or None if it is not there """
+        if self.static:
+            if parent_id is None:
+                children = self.__maintree.get_root().get_children()
+            elif self.__maintree.has_node(parent_id):
+                children = self.__maintree.get_node(parent_id).get_children()
+            else:
+                return None
+            if node_id in children:
+                return children.index(node_id)
+            return None
+        else:
+            return self.__ft.node_position(node_id, parent_id)
+
     # FILTERS #################################################################
     def list_applied_filters(self):
         return self.__ft.list_applied_filters()
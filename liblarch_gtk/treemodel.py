@@ -36,6 +36,9 @@ class TreeModel(Gtk.TreeStore):
         super(TreeModel, self).__init__(*only_types)
         self.cache_paths = {}
         self.cache_position = {}
+        # Paths of subtrees whose rows are removed, but the deletion of
+        # their nodes was not announced yet
+        self.removed_subtrees = set()
         self.tree = tree
 
     def set_column_function(self, column_num, column_func):
@@ -58,6 +61,8 @@ class TreeModel(Gtk.TreeStore):
 
         self.tree.register_cllbck('node-added-inview', self.add_task)
         self.tree.register_cllbck('node-deleted-inview', self.remove_task)
+        self.tree.register_cllbck('subtree-deleted-inview',
+                                  self.remove_subtree)
         self.tree.register_cllbck('node-modified-inview', self.update_task)
         self.tree.register_cllbck('node-children-reordered', self.reorder_nodes)
 
@@ -138,12 +143,16 @@ class TreeModel(Gtk.TreeStore):
             value = access_method(node)
             row.append(value)
 
-        # Find position to add task
+        # Find position to add task, rows follow the order of the view
         iter_path = path[:-1]
 
         iterator = self.my_get_iter(iter_path)
-        self.cache_position[path] = self.iter_n_children(iterator)
-        self.insert(iterator, -1, row)
+        parent_id = path[-2] if len(path) > 1 else None
+        position = self.tree.node_position(node_id, parent_id)
+        if position is None:
+            position = self.iter_n_children(iterator)
+        self.cache_position[path] = position
+        self.insert(iterator, position, row)
 
     def remove_task(self, node_id, path):
         """ Remove instance of node.
@@ -151,6 +160,16 @@ class TreeModel(Gtk.TreeStore):
         @param node_id: identification of task
         @param path: identification of position
         """
+        if self.removed_subtrees:
+            for length in range(1, len(path) + 1):
+                if path[:length] in self.removed_subtrees:
+                    # The row is already gone with its subtree
+                    if length == len(path):
+                        self.removed_subtrees.discard(path)
+                    self.cache_paths.pop(path, None)
+                    self.cache_position.pop(path, None)
+                    return
+
         it = self.my_get_iter(path)
         if not it:
             raise Exception(
@@ -160,6 +179,18 @@ class TreeModel(Gtk.TreeStore):
         self.remove(it)
         self.cache_position.pop(path)
 
+    def remove_subtree(self, node_id, path):
+        """ Remove instance of node together with all its descendants.
+
+        Deletions of the single nodes are still announced afterwards and
+        the node itself is announced last, they are only forgotten then.
+
+        @param node_id: identification of task
+        @param path: identification of position
+        """
+        self.remove_task(node_id, path)
+        self.removed_subtrees.add(path)
+
     def update_task(self, node_id, path):
         """ Update instance of node by rebuilding the row.
 
@@ -184,10 +215,8 @@ class TreeModel(Gtk.TreeStore):
     def reorder_nodes(self, node_id, path, neworder):
         """ Reorder nodes.
 
-        This is deprecated signal. In the past it was useful for reordering
-        showed nodes of tree. It was possible to delete just the last
-        element and therefore every element must be moved to the last position
-        and then deleted.
+        The signal is sent when the view is sorted by ViewTree.set_sort_key()
+        and children of a node change their order.
 
         @param node_id: identification of root node
         @param path: identification of position of root node
@@ -199,4 +228,3 @@ class TreeModel(Gtk.TreeStore):
         else:
             it = None
         self.reorder(it, neworder)
-        self.print_tree()
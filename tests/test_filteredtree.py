@@ -20,7 +20,7 @@
 import unittest
 from liblarch.treenode import _Node
 from liblarch.tree import MainTree
-from liblarch.filters_bank import FiltersBank
+from liblarch.filters_bank import FiltersBank, And, Or, Not
 from liblarch.filteredtree import FilteredTree
 
 
@@ -53,10 +53,9 @@ class TestFilteredTree(unittest.TestCase):
         self.assertTrue(self.filtered_tree.is_displayed(node_id="apple"))
         self.assertFalse(self.filtered_tree.is_displayed(node_id="google"))
 
-        # Due to self.refilter() implementation, all nodes are deleted
-        # at first and then only those satisfying the filter are added back.
-        self.assertEqual(2, self.deleted_nodes)
-        self.assertEqual(1, self.added_nodes)
+        # Only the node which does not satisfy the filter is deleted
+        self.assertEqual(1, self.deleted_nodes)
+        self.assertEqual(0, self.added_nodes)
 
         self.reset_counters()
 
@@ -75,8 +74,9 @@ class TestFilteredTree(unittest.TestCase):
 
         self.filtered_tree.apply_filter("true_filter")
 
-        self.assertEqual(2, self.deleted_nodes)
-        self.assertEqual(2, self.added_nodes)
+        # All nodes stay displayed, nothing is sent
+        self.assertEqual(0, self.deleted_nodes)
+        self.assertEqual(0, self.added_nodes)
 
         self.reset_counters()
 
@@ -85,6 +85,320 @@ class TestFilteredTree(unittest.TestCase):
         self.assertEqual(0, self.deleted_nodes)
         self.assertEqual(0, self.added_nodes)
 
+    def test_apply_filter_sends_only_difference(self):
+        self.tree.add_node(_Node(node_id="fruit"), parent_id="apple")
+        self.tree.add_node(_Node(node_id="pear"), parent_id="fruit")
+        self.filtersbank.add_filter(
+            "no_fruit", lambda node: node.get_id() != "fruit")
+
+        events = []
+        self.filtered_tree.set_callback(
+            'deleted', lambda node_id, path: events.append(('deleted', path)))
+        self.filtered_tree.set_callback(
+            'added', lambda node_id, path: events.append(('added', path)))
+
+        self.filtered_tree.apply_filter("no_fruit")
+        self.assertEqual([
+            ('deleted', ('apple', 'fruit', 'pear')),
+            ('deleted', ('apple', 'fruit')),
+            ('added', ('pear', )),
+        ], events)
+
+        del events[:]
+        self.filtered_tree.unapply_filter("no_fruit")
+        self.assertEqual([
+            ('deleted', ('pear', )),
+            ('added', ('apple', 'fruit')),
+            ('added', ('apple', 'fruit', 'pear')),
+        ], events)
+
+    def test_children_follow_order_of_tree(self):
+        self.tree.add_node(_Node(node_id="pear"), parent_id="apple")
+        self.tree.add_node(_Node(node_id="plum"), parent_id="apple")
+        self.tree.new_relationship("google", "pear")
+        self.filtersbank.add_filter(
+            "no_pear", lambda node: node.get_id() != "pear")
+
+        view = FilteredTree(self.tree, self.filtersbank, refresh=False)
+        view.refilter()
+        self.assertEqual(["pear", "plum"], view.node_all_children("apple"))
+
+        view.apply_filter("no_pear")
+        view.unapply_filter("no_pear")
+        self.assertEqual(["pear", "plum"], view.node_all_children("apple"))
+
+    def test_refilter_of_empty_view_sends_paths_in_order(self):
+        self.tree.add_node(_Node(node_id="fruit"), parent_id="apple")
+        self.tree.add_node(_Node(node_id="pear"), parent_id="fruit")
+        self.tree.new_relationship("google", "fruit")
+
+        view = FilteredTree(self.tree, self.filtersbank, refresh=False)
+        paths = []
+        view.set_callback('added', lambda node_id, path: paths.append(path))
+        view.refilter()
+        self.assertEqual([
+            ('apple', ),
+            ('apple', 'fruit'),
+            ('apple', 'fruit', 'pear'),
+            ('google', ),
+            ('google', 'fruit'),
+            ('google', 'fruit', 'pear'),
+        ], paths)
+        view.test_validity()
+
+    def test_paths_follow_parent_changes(self):
+        self.tree.add_node(_Node(node_id="fruit"), parent_id="apple")
+        self.tree.add_node(_Node(node_id="pear"), parent_id="fruit")
+        self.assertEqual([('apple', 'fruit', 'pear')],
+                         self.filtered_tree.get_paths_for_node("pear"))
+
+        self.tree.new_relationship("google", "fruit")
+        self.assertEqual([('apple', 'fruit', 'pear'),
+                          ('google', 'fruit', 'pear')],
+                         self.filtered_tree.get_paths_for_node("pear"))
+        self.assertEqual("pear", self.filtered_tree.get_node_for_path(
+            ('google', 'fruit', 'pear')))
+
+        self.tree.break_relationship("apple", "fruit")
+        self.assertEqual([('google', 'fruit', 'pear')],
+                         self.filtered_tree.get_paths_for_node("pear"))
+        self.assertEqual(None, self.filtered_tree.get_node_for_path(
+            ('apple', 'fruit', 'pear')))
+
+        self.tree.remove_node("fruit")
+        self.assertEqual([('pear', )],
+                         self.filtered_tree.get_paths_for_node("pear"))
+        self.assertEqual(None, self.filtered_tree.get_node_for_path(
+            ('google', 'fruit')))
+
+    def test_filter_results_are_cached(self):
+        self.tree.add_node(_Node(node_id="fruit"), parent_id="apple")
+        calls = []
+
+        def has_pink(node):
+            calls.append(node.get_id())
+            if node.get_id() == "pink":
+                return True
+            for child_id in node.get_children():
+                if has_pink(self.tree.get_node(child_id)):
+                    return True
+            return False
+
+        self.filtersbank.add_filter("has_pink", has_pink)
+        filt = self.filtersbank.get_filter("has_pink")
+        self.filtered_tree.apply_filter("has_pink")
+        self.assertEqual([], self.filtered_tree.get_all_nodes())
+
+        # A second view with the same filter reuses the results
+        del calls[:]
+        other_tree = FilteredTree(self.tree, self.filtersbank)
+        other_tree.apply_filter("has_pink")
+        self.assertEqual([], calls)
+
+        # A change drops results of the node and its relatives only
+        self.tree.modify_node("fruit")
+        self.assertNotIn('google', calls)
+        self.assertIn('apple', calls)
+
+        # Results are dropped before the views see changes of the batch
+        self.tree.begin_update()
+        self.tree.add_node(_Node(node_id="pear"), parent_id="apple")
+        self.tree.add_node(_Node(node_id="pink"), parent_id="fruit")
+        self.tree.new_relationship("pear", "pink")
+        self.tree.end_update()
+        self.assertEqual(['apple', 'fruit', 'pear', 'pink'],
+                         sorted(self.filtered_tree.get_all_nodes()))
+
+        # New parameters drop all results
+        version = filt.version
+        filt.set_parameters({'flat': False})
+        self.assertEqual(version + 1, filt.version)
+        self.assertEqual({}, filt.cache)
+
+    def test_cached_results_of_descendants(self):
+        """ Results of descendants are dropped only for filters depending
+        on ancestors """
+        self.tree.add_node(_Node(node_id="fruit"), parent_id="apple")
+        self.tree.add_node(_Node(node_id="pear"), parent_id="fruit")
+        self.filtersbank.add_filter("true", self.true_filter)
+        self.filtersbank.add_filter(
+            "under_apple",
+            lambda node, parameters: 'apple' in node.get_parents(),
+            parameters={'ancestors': True})
+        plain = self.filtersbank.get_filter("true")
+        inherited = self.filtersbank.get_filter("under_apple")
+        for node_id in ["apple", "fruit", "pear", "google"]:
+            plain.is_displayed(node_id)
+            inherited.is_displayed(node_id)
+
+        self.tree.modify_node("fruit")
+        self.assertEqual(["google", "pear"], sorted(plain.cache))
+        self.assertEqual(["google"], sorted(inherited.cache))
+
+    def test_flat_view(self):
+        """ A flat view lists nodes without their relationships and
+        follows changes of descendants """
+        self.tree.add_node(_Node(node_id="fruit"), parent_id="apple")
+        self.tree.add_node(_Node(node_id="pear"), parent_id="fruit")
+        self.filtersbank.add_filter(
+            "leaf", lambda node, parameters: not node.has_child(),
+            parameters={'flat': True})
+        self.filtered_tree.apply_filter("leaf")
+        self.assertEqual(["google", "pear"],
+                         sorted(self.filtered_tree.get_all_nodes()))
+        self.assertEqual([("pear", )],
+                         self.filtered_tree.get_paths_for_node("pear"))
+        self.assertEqual("pear",
+                         self.filtered_tree.get_node_for_path(("pear", )))
+        self.assertEqual(None, self.filtered_tree.get_node_for_path(
+            ("fruit", "pear")))
+
+        events = []
+        self.filtered_tree.set_callback(
+            'added', lambda node_id, path: events.append(('added', path)))
+        self.filtered_tree.set_callback(
+            'deleted', lambda node_id, path: events.append(('deleted', path)))
+        self.tree.remove_node("pear")
+        self.assertEqual([('added', ('fruit', )), ('deleted', ('pear', ))],
+                         sorted(events))
+
+        del events[:]
+        self.tree.add_node(_Node(node_id="seed"), parent_id="fruit")
+        self.assertEqual([('added', ('seed', )), ('deleted', ('fruit', ))],
+                         sorted(events))
+        self.assertEqual(["google", "seed"],
+                         sorted(self.filtered_tree.get_all_nodes()))
+        self.assertEqual(2, self.filtered_tree.node_n_children(
+            None, recursive=True))
+
+        self.filtered_tree.unapply_filter("leaf")
+        self.assertEqual([('apple', 'fruit', 'seed')],
+                         self.filtered_tree.get_paths_for_node("seed"))
+        self.filtered_tree.test_validity()
+
+    def test_filter_expressions(self):
+        self.tree.add_node(_Node(node_id="pear"))
+        self.filtersbank.add_filter(
+            "is_apple", lambda node: node.get_id() == "apple")
+        self.filtersbank.add_filter(
+            "is_pear", lambda node: node.get_id() == "pear")
+        self.filtersbank.add_filter(
+            "fruit", Or("is_apple", "is_pear"))
+        self.filtersbank.add_filter(
+            "no_apple", And("fruit", Not("is_apple")))
+
+        self.filtered_tree.apply_filter("fruit")
+        self.assertEqual(["apple", "pear"],
+                         sorted(self.filtered_tree.get_all_nodes()))
+        self.filtered_tree.apply_filter("no_apple", reset=True)
+        self.assertEqual(["pear"], self.filtered_tree.get_all_nodes())
+        self.filtered_tree.apply_filter(
+            "no_apple", parameters={'negate': True})
+        self.assertEqual(["apple", "google"],
+                         sorted(self.filtered_tree.get_all_nodes()))
+
+        # Missing filters do not display anything
+        self.filtersbank.add_filter("missing", Or("unknown"))
+        self.filtered_tree.apply_filter("missing")
+        self.assertEqual([], self.filtered_tree.get_all_nodes())
+        self.assertRaises(ValueError, self.filtersbank.add_filter,
+                          "itself", And("fruit", "itself"))
+
+    def test_applied_filters_are_reordered(self):
+        """ A cheap filter which hides most nodes is evaluated first """
+        for i in range(100):
+            self.tree.add_node(_Node(node_id="node%d" % i))
+
+        def slow_filter(node):
+            sum(range(2000))
+            return True
+
+        self.filtersbank.add_filter("slow", slow_filter)
+        self.filtersbank.add_filter(
+            "selective", lambda node: node.get_id() == "node7")
+        self.filtered_tree.apply_filter("slow", refresh=False)
+        self.filtered_tree.apply_filter("selective", refresh=False)
+        self.assertEqual(["slow", "selective"],
+                         self.filtered_tree.get_filter_order())
+
+        for i in range(10):
+            self.tree.refresh_all()
+        self.assertEqual(["node7"], self.filtered_tree.get_all_nodes())
+        self.assertEqual(["selective", "slow"],
+                         self.filtered_tree.get_filter_order())
+        self.assertEqual(["slow", "selective"],
+                         self.filtered_tree.list_applied_filters())
+
+    def test_filter_profiling(self):
+        self.filtersbank.add_filter(
+            "is_apple", lambda node: node.get_id() == "apple")
+        self.filtersbank.set_profiling()
+        self.filtersbank.add_filter("true_filter", self.true_filter)
+        self.filtered_tree.apply_filter("is_apple")
+        self.filtered_tree.apply_filter("true_filter")
+        self.tree.modify_node("google")
+
+        report = dict((item['name'], item)
+                      for item in self.filtersbank.get_profile())
+        self.assertEqual(['is_apple', 'true_filter'], sorted(report))
+        self.assertEqual(3, report['is_apple']['calls'])
+        self.assertEqual(1.0 / 3, report['is_apple']['pass_ratio'])
+        self.assertEqual(1.0, report['true_filter']['pass_ratio'])
+        self.assertTrue(report['is_apple']['cache_hits'] > 0)
+        self.assertTrue(report['is_apple']['p99'] >=
+                        report['is_apple']['p50'] > 0)
+        self.assertIn('is_apple', self.filtersbank.print_profile(string=True))
+
+        self.filtersbank.set_profiling(False)
+        self.assertEqual([], self.filtersbank.get_profile())
+
+    def test_sorted_children(self):
+        """ Children are kept sorted and moved when their key changes """
+        ranks = {"apple": 3, "google": 1, "pear": 2, "seed": 2, "core": 1}
+        self.tree.add_node(_Node(node_id="pear"))
+        self.tree.add_node(_Node(node_id="seed"), parent_id="apple")
+        self.tree.add_node(_Node(node_id="core"), parent_id="apple")
+
+        reorders = []
+        self.filtered_tree.set_callback(
+            'reordered', lambda node_id, path, neworder: reorders.append(
+                (node_id, path, neworder)))
+        self.filtered_tree.set_sort_key(
+            lambda node: ranks[node.get_id()])
+        self.assertEqual(["google", "pear", "apple"],
+                         self.filtered_tree.node_all_children())
+        self.assertEqual(["core", "seed"],
+                         self.filtered_tree.node_all_children("apple"))
+        self.assertEqual([("anonymous_root", (), [1, 2, 0]),
+                          ("apple", ("apple", ), [1, 0])], reorders)
+
+        # Equal keys keep the order of adding
+        del reorders[:]
+        ranks["banana"] = 2
+        self.tree.add_node(_Node(node_id="banana"))
+        self.assertEqual(["google", "pear", "banana", "apple"],
+                         self.filtered_tree.node_all_children())
+        self.assertEqual([], reorders)
+
+        ranks["google"] = 5
+        self.tree.modify_node("google")
+        self.assertEqual(["pear", "banana", "apple", "google"],
+                         self.filtered_tree.node_all_children())
+        self.assertEqual([("anonymous_root", (), [1, 2, 3, 0])], reorders)
+
+        # A node without a changed key stays
+        del reorders[:]
+        self.tree.modify_node("banana")
+        self.assertEqual([], reorders)
+
+        self.filtered_tree.set_sort_key(
+            lambda node: ranks[node.get_id()], reverse=True)
+        self.assertEqual(["google", "apple", "pear", "banana"],
+                         self.filtered_tree.node_all_children())
+        self.assertEqual(["seed", "core"],
+                         self.filtered_tree.node_all_children("apple"))
+        self.filtered_tree.test_validity()
+
     def added(self, node_id, path):
         self.added_nodes += 1
 
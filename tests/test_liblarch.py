@@ -23,6 +23,9 @@ import gi  # noqa
 gi.require_version('Gtk', '3.0')  # noqa
 import functools
 import inspect
+import os
+import shutil
+import tempfile
 import time
 import random
 from gi.repository import GLib
@@ -929,6 +932,28 @@ class TestLibLarch(unittest.TestCase):
         view.apply_filter('green')
         self.assertEqual(None, view.next_node('temp'))
 
+    def test_viewtree_prev_node(self):
+        """ prev_node() walks siblings backwards, also after removals """
+        view = self.tree.get_viewtree(refresh=True)
+        for i in range(100):
+            self.tree.add_node(DummyNode('temp%d' % i), parent_id='0')
+        for i in range(0, 100, 3):
+            self.tree.del_node('temp%d' % i)
+        expected = ['temp%d' % i for i in range(100) if i % 3]
+
+        for tree in (view, self.mainview):
+            self.assertEqual(None, tree.prev_node('temp1', pid='0'))
+            self.assertEqual('temp1', tree.prev_node('temp2'))
+            node_id = expected[-1]
+            walked = [node_id]
+            while tree.prev_node(node_id) is not None:
+                node_id = tree.prev_node(node_id)
+                walked.append(node_id)
+            self.assertEqual(expected, list(reversed(walked)))
+            self.assertEqual('temp5', tree.next_node('temp4'))
+            self.assertEqual('temp8', tree.node_nth_child('0', 5))
+            self.assertEqual('0', tree.node_nth_child(None, 0))
+
     def test_viewtree_node_has_child(self):
         view = self.tree.get_viewtree(refresh=True)
         """Test node_has_child() for TreeView
@@ -1856,6 +1881,43 @@ class TestLibLarch(unittest.TestCase):
         self.view.apply_filter('blue')
         self.assertEqual(self.value, 1)
 
+    def test_recursive_count_of_instances(self):
+        """ Recursive counts are kept for every instance of a node and
+        follow changes of the view """
+        view = self.tree.get_viewtree()
+        self.tree.add_node(DummyNode('a'), parent_id='0')
+        self.tree.add_node(DummyNode('b'), parent_id='a')
+        self.tree.add_node(DummyNode('c'), parent_id='b')
+        total = view.node_n_children(None, recursive=True)
+        self.assertEqual(2, view.node_n_children('a', recursive=True))
+        self.assertEqual(3, view.node_n_children('0', recursive=True))
+
+        # b and c are displayed twice
+        self.tree.add_parent('b', '1')
+        self.assertEqual(2, view.node_n_children('1', recursive=True))
+        self.assertEqual(total + 2, view.node_n_children(None, recursive=True))
+
+        self.tree.del_node('c')
+        self.assertEqual(1, view.node_n_children('1', recursive=True))
+        self.assertEqual(2, view.node_n_children('0', recursive=True))
+
+        view.apply_filter('blue')
+        self.assertEqual(len(view.get_all_nodes()),
+                         view.node_n_children(None, recursive=True))
+
+    def test_recursive_count_in_deleted_callback(self):
+        """ A deleted node is already unlinked when its deletion is sent """
+        counts = []
+
+        def count(node_id, path):
+            counts.append((node_id,
+                           self.view.node_n_children('9', recursive=True),
+                           self.view.node_n_children(None, recursive=True)))
+
+        self.view.register_cllbck('node-deleted-inview', count)
+        self.tree.del_node('14')
+        self.assertEqual([('14', 4, self.total - 1)], counts)
+
     def test_performance_of_filter_counting(self):
         """ Simulate counting tags as in GTG use case.
 
@@ -2021,3 +2083,526 @@ class TestLibLarch(unittest.TestCase):
         self.treeview.expand_node(('123123123123',)) # Should schedule
         self.tree.add_node(DummyNode('123123123123')) # Would've errored
         # TypeError: argument path: Expected Gtk.TreePath, but got tuple
+
+    def test_pending_relationships_stats(self):
+        """ Children added before their parent are counted as pending
+        relationships until the parent arrives """
+        self.assertEqual(0, self.tree.get_stats()['pending_relationships'])
+
+        for i in range(10):
+            self.tree.add_node(DummyNode('orphan%d' % i), parent_id='late')
+        self.assertEqual(10, self.tree.get_stats()['pending_relationships'])
+
+        self.tree.del_node('orphan0')
+        self.assertEqual(9, self.tree.get_stats()['pending_relationships'])
+
+        self.tree.add_node(DummyNode('late'))
+        self.assertEqual(0, self.tree.get_stats()['pending_relationships'])
+        self.assertEqual(
+            ['orphan%d' % i for i in range(1, 10)],
+            self.mainview.node_all_children('late'))
+
+    def test_batch_coalesces_changes(self):
+        """ Changes inside a batch are sent once the batch is finished and
+        redundant changes are dropped """
+        events = []
+        for event in ['node-added', 'node-modified', 'node-deleted']:
+            self.mainview.register_cllbck(
+                event, functools.partial(
+                    lambda event, node_id, path: events.append(
+                        (event, node_id)), event))
+
+        with self.tree.batch():
+            node = DummyNode('temp')
+            self.tree.add_node(node)
+            node.add_color('blue')
+            node.add_color('red')
+            self.tree.add_node(DummyNode('short_lived'))
+            self.tree.del_node('short_lived')
+            self.tree.refresh_node('0')
+            self.tree.refresh_node('0')
+            self.assertEqual([], events)
+            self.assertFalse(self.view.is_displayed('temp'))
+
+        self.assertEqual(
+            [('node-added', 'temp'), ('node-modified', '0')], events)
+        self.assertTrue(self.view.is_displayed('temp'))
+
+        self.assertRaises(Exception, self.tree.end_update)
+
+    def test_batch_removes_short_lived_nodes_from_views(self):
+        """ A view refiltered during a batch drops nodes which were added
+        and deleted in the same batch """
+        with self.tree.batch():
+            node = DummyNode('short_lived')
+            node.add_color('blue')
+            self.tree.add_node(node)
+            view = self.tree.get_viewtree(refresh=True)
+            view.apply_filter('blue')
+            self.tree.del_node('short_lived')
+
+        self.assertFalse(view.is_displayed('short_lived'))
+        self.assertNotIn('short_lived', view.get_all_nodes())
+        self.assertEqual(
+            self.view.get_n_nodes(withfilters=['blue']), view.get_n_nodes())
+
+    def test_is_ancestor(self):
+        """ Ancestors are updated when relationships change """
+        # Green nodes are in a chain 9 -> 10 -> 11 -> 12 -> 13 -> 14
+        self.assertTrue(self.tree.is_ancestor('9', '14'))
+        self.assertTrue(self.tree.is_ancestor('13', '14'))
+        self.assertFalse(self.tree.is_ancestor('14', '9'))
+        self.assertFalse(self.tree.is_ancestor('0', '14'))
+        self.assertFalse(self.tree.is_ancestor('14', '14'))
+
+        self.tree.move_node('12', '1')
+        self.assertTrue(self.tree.is_ancestor('1', '14'))
+        self.assertFalse(self.tree.is_ancestor('9', '14'))
+        self.assertTrue(self.tree.is_ancestor('9', '11'))
+
+        self.tree.add_parent('12', '0')
+        self.assertTrue(self.tree.is_ancestor('0', '14'))
+        self.assertTrue(self.tree.is_ancestor('1', '14'))
+
+        self.tree.del_node('1')
+        self.assertFalse(self.tree.is_ancestor('1', '14'))
+        self.assertTrue(self.tree.is_ancestor('0', '14'))
+
+    def test_children_order_after_removal(self):
+        """ Index lookups stay correct when many siblings are removed """
+        parent = self.tree.get_node('0')
+        children = ['child%d' % i for i in range(100)]
+        for child_id in children:
+            self.tree.add_node(DummyNode(child_id), parent_id='0')
+
+        for child_id in children[::3]:
+            self.tree.del_node(child_id)
+            children.remove(child_id)
+
+        self.assertEqual(children, parent.get_children())
+        for index, child_id in enumerate(children):
+            self.assertTrue(parent.has_child(child_id))
+            self.assertEqual(index, parent.get_child_index(child_id))
+            self.assertEqual(child_id, parent.get_nth_child(index))
+
+        next_ids = [self.mainview.next_node(child_id)
+                    for child_id in children]
+        self.assertEqual(children[1:] + [None], next_ids)
+
+    def test_paths_follow_relationship_changes(self):
+        """ Cached paths are updated when relationships change """
+        self.tree.add_node(DummyNode('a'))
+        self.tree.add_node(DummyNode('b'))
+        self.tree.add_node(DummyNode('c'), parent_id='a')
+        self.tree.add_parent('c', 'b')
+        self.tree.add_node(DummyNode('d'), parent_id='c')
+
+        self.assertEqual([('a', 'c', 'd'), ('b', 'c', 'd')],
+                         self.mainview.get_paths_for_node('d'))
+        self.assertEqual(2, self.tree.count_paths('d'))
+        self.assertEqual('d', self.mainview.get_node_for_path(('b', 'c', 'd')))
+
+        self.tree.add_node(DummyNode('e'))
+        self.tree.add_parent('a', 'e')
+        self.tree.add_node(DummyNode('f'))
+        self.tree.add_parent('a', 'f')
+        self.assertEqual([('e', 'a', 'c', 'd'), ('f', 'a', 'c', 'd'),
+                          ('b', 'c', 'd')],
+                         self.mainview.get_paths_for_node('d'))
+        self.assertEqual(3, self.tree.count_paths('d'))
+
+        self.tree.del_node('b')
+        self.assertEqual([('e', 'a', 'c', 'd'), ('f', 'a', 'c', 'd')],
+                         self.mainview.get_paths_for_node('d'))
+        self.assertEqual(2, self.tree.count_paths('d'))
+        self.assertEqual(None,
+                         self.mainview.get_node_for_path(('b', 'c', 'd')))
+        self.assertEqual(1, self.tree.count_paths(None))
+
+    def test_recursive_delete_of_subtree(self):
+        """ Removing a subtree is announced once and every node is removed """
+        subtrees = []
+        self.view.register_cllbck(
+            'subtree-deleted-inview',
+            lambda node_id, path: subtrees.append((node_id, path)))
+
+        # A chain of nodes with one leaf each, ids are numbers because
+        # of the tester
+        self.tree.add_node(DummyNode('100'), parent_id='0')
+        for i in range(101, 200, 2):
+            self.tree.add_node(DummyNode(str(i)), parent_id=str(i - 1))
+            self.tree.add_node(DummyNode(str(i + 1)), parent_id=str(i - 1))
+        self.tree.add_parent('121', '1')
+
+        self.tree.del_node('100', recursive=True)
+
+        self.assertEqual([('100', ('0', '100'))], subtrees)
+        self.assertFalse(self.tree.has_node('100'))
+        self.assertFalse(self.tree.has_node('121'))
+        self.assertFalse(self.tree.has_node('199'))
+        self.assertEqual([], self.tree.get_node('0').get_children())
+        self.assertEqual([], self.tree.get_node('1').get_children())
+        self.assertEqual([], self.view.node_all_children('1'))
+        self.assertTrue(self.view.is_displayed('0'))
+        self.tester.test_validity()
+
+    def test_callback_registration(self):
+        """ Keys of callbacks are not reused and callbacks (de)registered
+        while an event is sent do not change who receives it """
+        calls = []
+
+        def register_another(node_id, path):
+            calls.append('first')
+            self.view.register_cllbck('node-modified-inview', lambda *a: None)
+
+        before = self.view.get_callback_counts().get(
+            'node-modified-inview', 0)
+
+        first = self.view.register_cllbck(
+            'node-modified-inview', register_another)
+        second = self.view.register_cllbck(
+            'node-modified-inview', lambda *a: calls.append('second'))
+        self.assertNotEqual(first, second)
+
+        self.tree.refresh_node('0')
+        self.assertEqual(['first', 'second'], calls)
+        self.assertEqual(
+            before + 3,
+            self.view.get_callback_counts()['node-modified-inview'])
+
+        self.view.deregister_cllbck('node-modified-inview', first)
+        third = self.view.register_cllbck(
+            'node-modified-inview', lambda *a: None)
+        self.assertNotIn(third, (first, second))
+        self.assertEqual(
+            before + 3,
+            self.view.get_callback_counts()['node-modified-inview'])
+
+        stats = self.tree.get_stats()
+        self.assertTrue(stats['callbacks']['node-modified'] > 0)
+
+    def test_refresh_all_sends_difference(self):
+        """ refresh_all() re-evaluates nodes changed behind the back of
+        the tree and only sends the difference """
+        view = self.tree.get_viewtree(refresh=False)
+        testblue = TreeTester(view)
+        view.apply_filter('blue')
+        events = []
+        for event in ('node-added-inview', 'node-deleted-inview'):
+            view.register_cllbck(
+                event,
+                lambda node_id, path, event=event: events.append(
+                    (event, node_id, path)))
+        viewcount = self.tree.get_viewcount(refresh=True)
+        viewcount.apply_filter('blue')
+        self.assertEqual(self.blue_nodes, viewcount.get_n_nodes())
+
+        # Change colors without notifying the tree
+        self.tree.get_node('0').colors.append('blue')
+        self.tree.get_node('5').colors.remove('blue')
+        self.tree.get_node('10').colors.append('blue')
+
+        self.tree.refresh_all()
+        self.assertEqual([
+            ('node-deleted-inview', '5', ('5', )),
+            ('node-added-inview', '0', ('0', )),
+            ('node-added-inview', '10', ('9', '10')),
+        ], events)
+        self.assertTrue(view.is_displayed('0'))
+        self.assertFalse(view.is_displayed('5'))
+        self.assertEqual(['10'], view.node_all_children('9'))
+        self.assertEqual(self.blue_nodes + 1, viewcount.get_n_nodes())
+        testblue.test_validity()
+
+    def test_counting_with_filters_follows_changes(self):
+        """ Counts of get_n_nodes(withfilters) are kept up to date """
+        def has_color(node, parameters):
+            return node.has_color(parameters['color'])
+
+        self.tree.add_filter('has_color', has_color,
+                             parameters={'color': 'blue'})
+        view = self.tree.get_viewtree(refresh=True)
+        self.assertEqual(self.blue_nodes,
+                         view.get_n_nodes(withfilters=['has_color']))
+
+        node = DummyNode('temp')
+        node.add_color('blue')
+        self.tree.add_node(node, parent_id='0')
+        self.assertEqual(self.blue_nodes + 1,
+                         view.get_n_nodes(withfilters=['has_color']))
+        self.assertIn('temp', view.get_nodes(withfilters=['has_color']))
+        nodes = view.get_nodes(withfilters=['has_color'])
+        self.assertEqual(
+            [node_id for node_id in view.get_all_nodes() if node_id in nodes],
+            nodes)
+
+        node.remove_color('blue')
+        self.assertEqual(self.blue_nodes,
+                         view.get_n_nodes(withfilters=['has_color']))
+
+        node.add_color('blue')
+        self.tree.del_node('temp')
+        self.assertEqual(self.blue_nodes,
+                         view.get_n_nodes(withfilters=['has_color']))
+
+        # New parameters of the filter are taken into account
+        other_view = self.tree.get_viewtree(refresh=False)
+        other_view.apply_filter('has_color', parameters={'color': 'green'})
+        self.assertEqual(self.green_nodes,
+                         view.get_n_nodes(withfilters=['has_color']))
+
+        # Counts are restricted to nodes displayed in the view
+        view.apply_filter('blue')
+        self.assertEqual(0, view.get_n_nodes(withfilters=['has_color']))
+
+        # Filters depending on ancestors follow changes of parents
+        def blue_parent(node, parameters):
+            return any(self.tree.get_node(parent_id).has_color('blue')
+                       for parent_id in node.get_parents())
+
+        self.tree.add_filter('blue_parent', blue_parent,
+                             parameters={'ancestors': True})
+        view = self.tree.get_viewtree(refresh=True)
+        parent = DummyNode('parent')
+        self.tree.add_node(parent)
+        self.tree.add_node(DummyNode('child'), parent_id='parent')
+        count = view.get_n_nodes(withfilters=['blue_parent'])
+        parent.add_color('blue')
+        self.assertEqual(count + 1,
+                         view.get_n_nodes(withfilters=['blue_parent']))
+
+    def test_propagation_in_deep_tree(self):
+        """ Changes are propagated without recursion and every node is
+        updated a bounded number of times """
+        tree = Tree()
+        depth = 1000
+        parent_id = None
+        for i in range(depth):
+            node_id = 'deep%d' % i
+            tree.add_node(DummyNode(node_id), parent_id=parent_id)
+            parent_id = node_id
+        leaf = tree.get_node(parent_id)
+
+        # Every node depends on the deepest one
+        tree.add_filter('blue_leaf',
+                        lambda node, parameters=None: leaf.has_color('blue'))
+        view = tree.get_viewtree(refresh=False)
+        view.apply_filter('blue_leaf')
+        self.assertEqual(0, view.get_n_nodes())
+
+        leaf.add_color('blue')
+        self.assertEqual(depth, view.get_n_nodes())
+        self.assertEqual([parent_id], view.node_all_children('deep%d' % (depth - 2)))
+        stats = view.get_propagation_stats()
+        self.assertTrue(stats['last'] <= 3 * depth)
+
+        leaf.remove_color('blue')
+        self.assertEqual(0, view.get_n_nodes())
+
+    def test_tree_changed_from_view_callback(self):
+        """ Changes done by a callback are added to the running update """
+        view = self.tree.get_viewtree()
+        test = TreeTester(view)
+
+        def add_child(node_id, path):
+            if node_id == 'parent' and not self.tree.has_node('child'):
+                self.tree.add_node(DummyNode('child'), parent_id='parent')
+
+        view.register_cllbck('node-added-inview', add_child)
+        self.tree.add_node(DummyNode('parent'))
+        self.assertEqual(['child'], view.node_all_children('parent'))
+        test.test_validity()
+
+    def test_batched_view(self):
+        """ In the batched mode, all changes of an update come at once """
+        view = self.tree.get_viewtree(refresh=False)
+        test = TreeTester(view)
+        view.set_batched()
+        batches = []
+        events = []
+        view.register_cllbck('changes-inview', batches.append)
+        for event in ('node-added-inview', 'node-deleted-inview',
+                      'subtree-deleted-inview', 'node-modified-inview'):
+            view.register_cllbck(
+                event,
+                lambda node_id, path, event=event: events.append(
+                    (event, node_id, path)))
+
+        view.apply_filter('blue')
+        self.assertEqual([events], batches)
+        self.assertEqual(self.blue_nodes, len(events))
+
+        del events[:]
+        view.unapply_filter('blue')
+        self.assertEqual(2, len(batches))
+        self.assertEqual(events, batches[-1])
+        self.assertIn(('node-added-inview', '10', ('9', '10')), events)
+        test.test_validity()
+
+        view.set_batched(False)
+        self.tree.add_node(DummyNode('temp'))
+        self.assertEqual(2, len(batches))
+
+        static = self.tree.get_main_view()
+        self.assertRaises(Exception, static.set_batched)
+
+    def test_memory_usage(self):
+        """ Memory used by caches of a view follows displayed nodes """
+        view = self.tree.get_viewtree(refresh=False)
+        empty = view.memory_usage()
+        self.assertTrue(empty > 0)
+
+        view.apply_filter('blue')
+        blue = view.memory_usage()
+        self.assertTrue(blue > empty)
+
+        view.unapply_filter('blue')
+        for node_id in view.get_all_nodes():
+            view.get_paths_for_node(node_id)
+        self.assertTrue(view.memory_usage() > blue)
+
+    def test_lazy_view(self):
+        """ A lazy view computes children of expanded nodes only """
+        view = self.tree.get_viewtree(lazy=True)
+        test = TreeTester(view)
+        self.assertEqual(10, len(view.get_all_nodes()))
+        self.assertFalse(view.is_expanded('9'))
+        self.assertTrue(view.node_has_child('9'))
+        self.assertFalse(view.node_has_child('0'))
+        self.assertEqual(0, view.node_n_children('9'))
+
+        view.expand_node('9')
+        self.assertEqual([('9', '10')], view.get_paths_for_node('10'))
+        self.assertTrue(view.node_has_child('10'))
+        self.assertFalse(view.is_displayed('11'))
+        test.test_validity()
+
+        # Changes under collapsed nodes are not sent
+        self.tree.move_node('11', None)
+        self.assertEqual([('11', )], view.get_paths_for_node('11'))
+        self.tree.add_node(DummyNode('15'), parent_id='10')
+        self.assertFalse(view.is_displayed('15'))
+        test.test_validity()
+
+        view.collapse_node('9')
+        self.assertFalse(view.is_displayed('10'))
+        self.assertEqual(11, len(view.get_all_nodes()))
+        test.test_validity()
+
+        # Expanding a node under a collapsed one shows nothing yet
+        view.expand_node('10')
+        self.assertFalse(view.is_displayed('15'))
+        view.expand_node('9')
+        self.assertEqual([('9', '10', '15')], view.get_paths_for_node('15'))
+        test.test_validity()
+
+        # A plain view is always expanded
+        self.assertTrue(self.view.is_expanded('9'))
+        self.assertEqual(self.total + 1, len(self.view.get_all_nodes()))
+
+    def test_window_of_children(self):
+        """ A window gives a part of children and follows only its rows """
+        self.assertEqual((['2', '3', '4'], 10), self.view.get_window(None, 2, 3))
+        self.assertEqual((['8', '9'], 10), self.view.get_window(None, 8, 5))
+        self.assertEqual((['10'], 1), self.view.get_window('9'))
+        self.assertEqual(([], 0), self.view.get_window('missing'))
+        self.assertEqual((['2', '3'], 10),
+                         self.mainview.get_window(None, 2, 2))
+
+        events = []
+        key = self.view.subscribe_window(
+            None, 2, 3,
+            lambda event, node_id, path, position: events.append(
+                (event, node_id, position)))
+
+        self.tree.get_node('3').modified()
+        self.tree.get_node('7').modified()
+        self.tree.get_node('0').modified()
+        self.assertEqual([('node-modified-inview', '3', 3)], events)
+
+        # Removing a row before the window shifts the window
+        del events[:]
+        self.tree.del_node('1')
+        self.assertEqual([('node-deleted-inview', '1', 1)], events)
+        self.assertEqual((['3', '4', '5'], 9), self.view.get_window(None, 2, 3))
+
+        del events[:]
+        self.tree.add_node(DummyNode('15'))
+        self.tree.add_node(DummyNode('16'), parent_id='4')
+        self.assertEqual([('node-modified-inview', '4', 3)], events)
+
+        del events[:]
+        self.view.unsubscribe_window(key)
+        self.tree.get_node('3').modified()
+        self.assertEqual([], events)
+        self.assertRaises(Exception, self.mainview.subscribe_window,
+                          None, 0, 1, events.append)
+
+    def test_window_of_flat_view(self):
+        """ Hidden rows of a flat view are reported with their positions """
+        view = self.tree.get_viewtree(refresh=False)
+        view.apply_filter('flatgreen')
+        self.assertEqual((['10', '11', '12'], 5), view.get_window(None, 0, 3))
+
+        events = []
+        view.subscribe_window(
+            None, 0, 3,
+            lambda event, node_id, path, position: events.append(
+                (event, node_id, position)))
+
+        for node_id in ('14', '11'):
+            node = self.tree.get_node(node_id)
+            node.remove_color('green')
+            node.modified()
+        # Ancestors of the nodes are modified as well
+        deleted = [event for event in events
+                   if event[0] == 'node-deleted-inview']
+        self.assertEqual([('node-deleted-inview', '11', 1)], deleted)
+        self.assertEqual((['10', '12', '13'], 3), view.get_window(None, 0, 3))
+
+    def test_snapshot(self):
+        """ A tree loaded from a snapshot has the same nodes, relationships
+        and payloads """
+        self.tree.add_parent('12', '3')
+        self.tree.add_node(DummyNode('orphan'), parent_id='missing')
+
+        def payload(node):
+            return ','.join(node.colors).encode('utf-8')
+
+        def factory(node_id, payload):
+            node = DummyNode(node_id)
+            colors = payload.decode('utf-8').split(',')
+            node.colors = [color for color in colors if color]
+            return node
+
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'tree.snapshot')
+        try:
+            self.tree.save_snapshot(path, payload)
+
+            loaded = Tree()
+            loaded.add_filter('blue', self.is_blue)
+            blue = loaded.get_viewtree()
+            blue.apply_filter('blue')
+            loaded.load_snapshot(path, factory)
+            self.assertRaises(ValueError, loaded.load_snapshot, path, factory)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        main = loaded.get_main_view()
+        self.assertEqual(sorted(self.mainview.get_all_nodes()),
+                         sorted(main.get_all_nodes()))
+        for node_id in self.mainview.get_all_nodes():
+            self.assertEqual(self.mainview.node_all_children(node_id),
+                             main.node_all_children(node_id))
+            self.assertEqual(self.mainview.node_parents(node_id),
+                             main.node_parents(node_id))
+            self.assertEqual(self.tree.get_node(node_id).colors,
+                             loaded.get_node(node_id).colors)
+        self.assertEqual(['12'], main.node_all_children('3'))
+        self.assertEqual(['5', '6', '7', '8', '9'],
+                         sorted(blue.get_all_nodes()))
+        self.assertEqual(1, loaded.get_stats()['pending_relationships'])
+
+        loaded.add_node(DummyNode('missing'))
+        self.assertEqual(['orphan'], main.node_all_children('missing'))